@@ -0,0 +1,61 @@
+# 1,000 件のフィードをシリアライズする時間を比べるマイクロベンチマーク。
+# リポジトリの親ディレクトリから python -m <パッケージ名>.benchmarks.bench_serialization で実行する
+import argparse
+import timeit
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from ..models.post_model import make_excerpt
+from ..models.responses import PostSummaryWithUser
+from ..models.user_model import UserPublic
+from ..serialization import PydanticJSONResponse
+
+
+def make_feed(size: int) -> list[PostSummaryWithUser]:
+    now = datetime.now()
+    users = [
+        UserPublic(id=i, name=f"user{i}", email=f"user{i}@example.com", image=None, provider="credentials", created_at=now, updated_at=now)
+        for i in range(10)
+    ]
+    return [
+        PostSummaryWithUser(
+            id=i,
+            title=f"投稿 {i}",
+            excerpt=make_excerpt("本文 " * 100),
+            user_id=i % 10,
+            created_at=now,
+            updated_at=now,
+            user=users[i % 10],
+        )
+        for i in range(size)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    feed = make_feed(args.size)
+    adapter = TypeAdapter(list[PostSummaryWithUser])
+    cases = {
+        # 戻り値の型がないルートや、response_class を指定したルートの経路
+        "jsonable_encoder + JSONResponse": lambda: JSONResponse(jsonable_encoder(feed)).body,
+        # ルーターで組み立てるレスポンス (serialization.PydanticJSONResponse)
+        "PydanticJSONResponse": lambda: PydanticJSONResponse(feed).body,
+        # 戻り値の型があるルートで FastAPI が行う検証 + dump_json
+        "TypeAdapter validate + dump_json": lambda: adapter.dump_json(adapter.validate_python(feed)),
+    }
+
+    assert len({bytes(fn()) for fn in cases.values()}) == 1, "serializers disagree"
+    for name, fn in cases.items():
+        seconds = min(timeit.repeat(fn, number=args.number, repeat=5)) / args.number
+        print(f"{name:36s} {seconds * 1000:8.2f} ms / {args.size} posts")
+
+
+if __name__ == "__main__":
+    main()
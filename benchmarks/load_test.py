@@ -0,0 +1,214 @@
+# /v1 のルートに同時にリクエストを送り、ルートごとのレイテンシ (p50/p95/p99)、RPS、クエリ数を JSON で出力する負荷テスト。
+# リポジトリの親ディレクトリで、Settings の値 (.env か環境変数) を用意して実行する:
+#   python -m <パッケージ名>.benchmarks.load_test --users 10000 --posts 1000000 --concurrency 32 --requests 20000 --output result.json
+# --database-url を省略すると一時ディレクトリの SQLite にマイグレーションを適用してデータを入れ、アプリをプロセス内 (ASGI) で動かす。
+# MySQL などを使う場合は空の DB の URL を渡す。--base-url を付けると起動中のサーバーに HTTP で送る (データは同じ DB に入れておく)
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, insert, update
+
+from ..database import get_read_session, get_session, make_session_dependencies
+from ..main import app
+from ..models.post_model import Post, make_excerpt
+from ..models.user_model import User
+from ..passwords import get_password_hash
+from ..post_stats import actual_last_posted_at, actual_post_count
+
+ROOT = Path(__file__).resolve().parents[1]
+
+PASSWORD = "benchmark-password"
+WORDS = ["FastAPI", "SvelteKit", "ブログ", "非同期", "データベース", "キャッシュ", "インデックス", "検索", "投稿", "ユーザー", "性能", "計測"]
+
+
+def migrate(database_url: str) -> None:
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("sqlalchemy.url", database_url)
+    command.upgrade(config, "head")
+
+
+# ユーザーと投稿を batch_size 件ずつの複数行 INSERT で入れる。パスワードは全員同じなので bcrypt は1回だけ
+def seed(engine, users: int, posts: int, rng: random.Random, batch_size: int = 5000) -> None:
+    password_digest = get_password_hash(PASSWORD)
+    now = datetime.now()
+    with engine.begin() as connection:
+        for start in range(0, users, batch_size):
+            connection.execute(insert(User), [
+                {
+                    "name": f"user{i}",
+                    "email": f"user{i}@example.com",
+                    "image": None,
+                    "provider": "credentials",
+                    "password_digest": password_digest,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+                for i in range(start, min(users, start + batch_size))
+            ])
+        for start in range(0, posts, batch_size):
+            rows = []
+            for i in range(start, min(posts, start + batch_size)):
+                body = " ".join(rng.choices(WORDS, k=rng.randint(20, 200)))
+                created_at = now - timedelta(seconds=posts - i)
+                rows.append({
+                    "title": f"投稿 {i}",
+                    "body": body,
+                    "excerpt": make_excerpt(body),
+                    "user_id": rng.randint(1, users),
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                })
+            connection.execute(insert(Post), rows)
+        # 直接 INSERT したので、投稿数と最新の投稿日時はまとめて数える
+        connection.execute(update(User).values(post_count=actual_post_count(), last_posted_at=actual_last_posted_at()))
+
+
+# シナリオ名: (重み, (rng, users, posts) -> (メソッド, パス, JSON ボディ))
+SCENARIOS = {
+    "GET /v1/posts": (20, lambda rng, users, posts: ("GET", "/v1/posts?limit=20", None)),
+    "GET /v1/posts?fields": (5, lambda rng, users, posts: ("GET", "/v1/posts?limit=20&fields=id,title,user.name", None)),
+    "GET /v1/posts/{id}": (30, lambda rng, users, posts: ("GET", f"/v1/posts/{rng.randint(1, posts)}", None)),
+    "GET /v1/posts?ids": (5, lambda rng, users, posts: (
+        "GET", "/v1/posts?ids=" + ",".join(str(rng.randint(1, posts)) for _ in range(20)), None
+    )),
+    "GET /v1/posts/search": (5, lambda rng, users, posts: ("GET", f"/v1/posts/search?q={rng.choice(WORDS)}", None)),
+    "GET /v1/users": (10, lambda rng, users, posts: ("GET", "/v1/users?limit=20&summary=true&posts_limit=3", None)),
+    "GET /v1/users/stats": (5, lambda rng, users, posts: ("GET", "/v1/users/stats?limit=20", None)),
+    "GET /v1/users?email": (10, lambda rng, users, posts: (
+        "GET", f"/v1/users?email=user{rng.randrange(users)}@example.com&provider=credentials", None
+    )),
+    "POST /v1/posts": (5, lambda rng, users, posts: (
+        "POST", "/v1/posts", {"title": "負荷テスト", "body": " ".join(rng.choices(WORDS, k=50)), "user_id": rng.randint(1, users)}
+    )),
+    "POST /v1/sessions": (2, lambda rng, users, posts: (
+        "POST", "/v1/sessions", {"email": f"user{rng.randrange(users)}@example.com", "password": PASSWORD, "provider": "credentials"}
+    )),
+    "POST /v1/oauth": (5, lambda rng, users, posts: (
+        "POST", "/v1/oauth", {"name": f"user{rng.randrange(users)}", "email": f"user{rng.randrange(users)}@example.com", "provider": "google"}
+    )),
+}
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summarize(samples: list[tuple[float, int, int]], elapsed: float) -> dict:
+    latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+    queries = [count for _, _, count in samples if count >= 0]
+    return {
+        "requests": len(samples),
+        "errors": sum(status >= 400 for _, status, _ in samples),
+        "rps": len(samples) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+        },
+        # X-Query-Count (QueryStatsMiddleware) が返っていれば集計する
+        "queries": {"mean": sum(queries) / len(queries), "max": max(queries)} if queries else None,
+    }
+
+
+# concurrency 個のタスクで合計 total 件のリクエストを重みに従って送る
+async def drive(client: httpx.AsyncClient, scenarios: dict, total: int, concurrency: int, users: int, posts: int, rng: random.Random) -> dict:
+    names = list(scenarios)
+    weights = [scenarios[name][0] for name in names]
+    samples: dict[str, list[tuple[float, int, int]]] = {name: [] for name in names}
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            name = rng.choices(names, weights)[0]
+            method, path, body = scenarios[name][1](rng, users, posts)
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            samples[name].append((time.perf_counter() - started, response.status_code, int(response.headers.get("x-query-count", -1))))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_seconds": elapsed,
+        "total": summarize([sample for name in names for sample in samples[name]], elapsed),
+        "routes": {name: summarize(samples[name], elapsed) for name in names if samples[name]},
+    }
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", help="データを入れる DB (省略時は一時ディレクトリの SQLite)")
+    parser.add_argument("--base-url", help="起動中のサーバーに送る場合の URL (省略時はプロセス内で実行)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--skip-seed", action="store_true", help="既にデータを入れた DB を使う")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--scenarios", nargs="*", choices=list(SCENARIOS), help="実行するシナリオ (省略時はすべて)")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード (同じ値なら同じデータと同じリクエスト列になる)")
+    parser.add_argument("--output", help="結果の JSON の出力先 (省略時は標準出力)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    scenarios = {name: SCENARIOS[name] for name in args.scenarios or SCENARIOS}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f"sqlite:///{directory}/benchmark.db"
+        connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+        engine = create_engine(database_url, connect_args=connect_args)
+        if not args.skip_seed:
+            migrate(database_url)
+            seed(engine, args.users, args.posts, rng)
+
+        if args.base_url:
+            client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+        else:
+            get_session_override, get_read_session_override = make_session_dependencies(engine, [], 0)
+            app.dependency_overrides[get_session] = get_session_override
+            app.dependency_overrides[get_read_session] = get_read_session_override
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+
+        async def run():
+            async with client:
+                return await drive(client, scenarios, args.requests, args.concurrency, args.users, args.posts, rng)
+
+        try:
+            result = asyncio.run(run())
+        finally:
+            app.dependency_overrides.clear()
+            engine.dispose()
+
+    report = {
+        "config": {
+            "database": engine.dialect.name,
+            "target": args.base_url or "in-process",
+            "users": args.users,
+            "posts": args.posts,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": args.seed,
+        },
+        **result,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        sys.stdout.write(output + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main()
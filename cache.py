@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+
+from . import config
+from .metrics import CACHE_REQUESTS
+
+settings = config.get_settings()
+
+
+# キャッシュの保存先。複数ワーカーで共有したい場合は Redis などでこのインターフェースを実装して差し替える
+class CacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    # バージョン番号は戻ってはいけない (古いエントリが復活するため)。追い出す場合は、追い出したキーの
+    # 番号を以前より小さくしないこと
+    @abstractmethod
+    async def version(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def bump(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def clear(self) -> None:
+        ...
+
+
+# プロセス内の TTL + LRU キャッシュ。
+# バージョン番号も最後に上げた順に max_entries 件までしか持たず、追い出した番号の最大値 (_version_floor) を
+# 持っていないキーの番号にする。追い出したキーの番号は以前以上になるので古いエントリは復活しない
+# (一度も上げていないキーは番号が変わってキャッシュを外れるだけ)
+class MemoryCache(CacheBackend):
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._versions: OrderedDict[str, int] = OrderedDict()
+        self._version_floor = 0
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def version(self, key: str) -> int:
+        with self._lock:
+            return self._versions.get(key, self._version_floor)
+
+    async def bump(self, key: str) -> int:
+        with self._lock:
+            version = self._versions.pop(key, self._version_floor) + 1
+            self._versions[key] = version
+            while len(self._versions) > self.max_entries:
+                _, evicted = self._versions.popitem(last=False)
+                self._version_floor = max(self._version_floor, evicted)
+            return version
+
+    async def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._version_floor = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# キャッシュするレスポンス。条件付き GET に本文なしで答えられるよう ETag と Last-Modified も持つ
+class CachedResponse(NamedTuple):
+    etag: str
+    last_modified: datetime | None
+    content: bytes
+
+    def pack(self) -> bytes:
+        last_modified = self.last_modified.isoformat() if self.last_modified else None
+        return json.dumps([self.etag, last_modified]).encode() + b"\n" + self.content
+
+    @classmethod
+    def unpack(cls, raw: bytes) -> "CachedResponse":
+        header, content = raw.split(b"\n", 1)
+        etag, last_modified = json.loads(header)
+        return cls(etag, datetime.fromisoformat(last_modified) if last_modified else None, content)
+
+
+# シリアライズ済みの投稿レスポンス (JSON のバイト列) のキャッシュ。
+# キーにバージョン番号を含め、書き込み後にバージョンを上げて無効化する。
+# 読み込み側は DB を読む前にキーを決めるので、書き込みと競合しても古い内容は古いキーに入るだけになる。
+# ただしレプリカは書き込みに遅れるので、書き込みから recent_write_seconds の間はレプリカから読んだ内容を
+# 新しいキーに入れない (入れると TTL の間、古い内容が全員に返る)
+class PostCache:
+    FEED = "posts:feed"
+    RECENT_WRITE = "posts:recent-write"
+
+    def __init__(self, backend: CacheBackend, ttl: float, recent_write_seconds: float = 0):
+        self.backend = backend
+        self.ttl = ttl
+        self.recent_write_seconds = recent_write_seconds
+        self.hits = 0
+        self.misses = 0
+
+    async def feed_key(self, *params) -> str:
+        version = await self.backend.version(self.FEED)
+        return f"{self.FEED}:{version}:" + ":".join(str(param) for param in params)
+
+    # params (fields の指定など) ごとに別のエントリになるが、無効化は投稿単位でまとめて行われる
+    async def post_key(self, id: int, *params) -> str:
+        version = await self.backend.version(f"posts:{id}")
+        return f"posts:{id}:{version}:" + ":".join(str(param) for param in params)
+
+    async def get(self, key: str) -> CachedResponse | None:
+        value = await self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.labels("hit").inc()
+        return CachedResponse.unpack(value)
+
+    async def set(self, key: str, value: CachedResponse) -> None:
+        await self.backend.set(key, value.pack(), self.ttl)
+
+    # 直近に書き込みがあった (レプリカがまだ追いついていないかもしれない) か
+    async def recently_written(self) -> bool:
+        return await self.backend.get(self.RECENT_WRITE) is not None
+
+    # 投稿の作成・更新・削除のあとに呼ぶ。フィードは全ページ、詳細は該当の投稿だけ無効にする。
+    # 新しいキーができる前に書き込みの印を付けておく
+    async def invalidate_posts(self, *ids: int) -> None:
+        if self.recent_write_seconds > 0:
+            await self.backend.set(self.RECENT_WRITE, b"1", self.recent_write_seconds)
+        await self.backend.bump(self.FEED)
+        for id in ids:
+            await self.backend.bump(f"posts:{id}")
+
+    async def clear(self) -> None:
+        await self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+post_cache = PostCache(
+    MemoryCache(settings.post_cache_max_entries), settings.post_cache_ttl_seconds, settings.db_read_your_writes_seconds
+)
@@ -0,0 +1,126 @@
+import gzip
+
+import anyio
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# brotli / zstandard はインストールされていれば使う (なければ gzip だけ)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSORS = {"gzip": lambda data, level: gzip.compress(data, compresslevel=level, mtime=0)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data, level: brotli.compress(data, quality=level)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda data, level: zstandard.ZstdCompressor(level=level).compress(data)
+
+COMPRESSIBLE_TYPES = ("application/json", "application/problem+json", "text/html", "text/plain")
+# これより大きい本文はスレッドで圧縮する
+THREAD_MIN_SIZE = 64 * 1024
+
+
+# Accept-Encoding の中から、q 値が最も大きいものを preferences の順で選ぶ
+def choose_encoding(accept_encoding: str, preferences: list[str]) -> str | None:
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, *params = (item.strip() for item in part.split(";"))
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name.lower()] = q
+
+    best, best_q = None, 0.0
+    for name in preferences:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+# レスポンス本文を Accept-Encoding に合わせて圧縮する ASGI ミドルウェア。
+# 1回で送られる本文 (JSON など) だけを対象にし、minimum_size 未満の小さいもの、304、
+# StreamingResponse (エクスポートなど more_body で分けて送るもの) は CPU を使わずにそのまま送る。
+# 圧縮しない種類のレスポンス (SSE など) はヘッダーをすぐに送り、本文を待たない
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int, encodings: list[str], levels: dict[str, int]):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = [encoding for encoding in encodings if encoding in COMPRESSORS]
+        self.levels = levels
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        start_message: Message | None = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message.setdefault("headers", []))
+                if self.is_candidate(message["status"], headers):
+                    # 圧縮するかは本文の大きさで決まるので、最初の本文まで待つ
+                    start_message = message
+                    return
+                if message["status"] == 304 and encoding is not None:
+                    # 圧縮した 200 と同じ弱い ETag にして、キャッシュから見た検証子をそろえる
+                    headers.add_vary_header("Accept-Encoding")
+                    self.weaken_etag(headers)
+                await send(message)
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            body = message.get("body", b"")
+            if encoding is not None:
+                # 小さくて圧縮しない場合も ETag は圧縮したときと同じ弱い形にする
+                self.weaken_etag(headers)
+                if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                    body = await self.compress(encoding, body)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+            start["headers"] = headers.raw
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    def is_candidate(self, status: int, headers: MutableHeaders) -> bool:
+        if status < 200 or status in (204, 304) or "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "").split(";")[0].strip()
+        return content_type in COMPRESSIBLE_TYPES
+
+    # 圧縮後は別の表現になるので、強い ETag を弱い ETag にする
+    def weaken_etag(self, headers: MutableHeaders) -> None:
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+
+    # 大きい本文の圧縮はイベントループを止めないようにスレッドで行う
+    async def compress(self, encoding: str, body: bytes) -> bytes:
+        compressor = COMPRESSORS[encoding]
+        if len(body) < THREAD_MIN_SIZE:
+            return compressor(body, self.levels[encoding])
+        return await anyio.to_thread.run_sync(compressor, body, self.levels[encoding])
@@ -11,6 +11,52 @@ class Settings(BaseSettings):
     db_host: str
     db_port: int
     db_name: str
+    # True にすると create_async_engine (aiomysql / aiosqlite) で DB に接続する
+    db_async: bool = False
+    # コネクションプール。ワーカー数 x (pool_size + max_overflow) が MySQL の max_connections に収まるようにする
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 3600
+    db_pool_pre_ping: bool = True
+    db_echo: bool = False
+    db_isolation_level: str | None = None
+    # 読み込み専用レプリカの URL (JSON の配列)。GET はここに振り分け、
+    # 書き込んだクライアントは db_read_your_writes_seconds の間だけプライマリから読む
+    db_replica_urls: list[str] = []
+    db_read_your_writes_seconds: float = 5
+
+    # bcrypt は専用スレッドで実行し、待ち行列があふれたら 503 を返す
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 16
+
+    # 投稿のフィードと詳細のレスポンスキャッシュ
+    post_cache_ttl_seconds: float = 30
+    post_cache_max_entries: int = 1024
+
+    # 投稿の一括作成・削除。1文の INSERT / DELETE にまとめる行数と、1リクエストで受け付ける件数
+    bulk_batch_size: int = 500
+    bulk_max_items: int = 10000
+
+    # エクスポートでサーバーサイドカーソルから1度に読む行数
+    export_batch_size: int = 1000
+
+    # レスポンスの圧縮。encodings は優先する順 (br / zstd はパッケージがあれば使う)。
+    # minimum_size バイト未満のレスポンスは圧縮しない
+    compression_encodings: list[str] = ["br", "zstd", "gzip"]
+    compression_minimum_size: int = 1024
+    compression_gzip_level: int = 6
+    compression_brotli_level: int = 5
+    compression_zstd_level: int = 3
+
+    # 投稿のイベント (SSE)。購読者ごとのキューの長さと、何もないときに keepalive を送る間隔
+    post_events_queue_size: int = 100
+    post_events_keepalive_seconds: float = 15
+
+    # リクエストごとの SQL の件数と時間を X-Query-Count / Server-Timing ヘッダーで返す。
+    # 同じ形の SQL がこの回数以上繰り返されたら N+1 の疑いとしてログに出す
+    query_stats_enabled: bool = True
+    query_n_plus_one_threshold: int = 5
 
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -1,18 +1,252 @@
-from sqlmodel import create_engine, Session, SQLModel
+import itertools
+import math
+import threading
+import time
+from typing import Callable, TypeVar
+
+from fastapi import Request, Response
+from sqlalchemy import Engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from . import config
+from .metrics import DB_POOL_CAPACITY, DB_POOL_CHECKED_OUT, DB_POOL_TIMEOUTS, DB_POOL_WAIT_SECONDS
 
 settings = config.get_settings()
 
 DATABASE_URL = f"{settings.database}://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
 
-engine = create_engine(DATABASE_URL, echo=True)
+# 非同期モードで使うドライバ
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+T = TypeVar("T")
+
+AnySession = Session | AsyncSession
+
+# 書き込んだクライアントをしばらくプライマリに固定するためのクッキー
+PRIMARY_STICKY_COOKIE = "db_primary_until"
+
+
+def async_database_url(url: str) -> str:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(hide_password=False)
+
+
+# プールからコネクションを取り出すまでに待った時間 (新規接続の時間を含む) を集計する
+class PoolWaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.timeouts += timed_out
+        DB_POOL_WAIT_SECONDS.observe(seconds)
+        if timed_out:
+            DB_POOL_TIMEOUTS.inc()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds,
+                "timeouts": self.timeouts,
+            }
+
+
+pool_wait = PoolWaitStats()
+
+
+class TimedPoolMixin:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_wait.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_wait.record(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(settings: config.Settings, poolclass: type[QueuePool]) -> dict:
+    options = {
+        "echo": settings.db_echo,
+        "poolclass": poolclass,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+    if settings.db_isolation_level:
+        options["isolation_level"] = settings.db_isolation_level
+    return options
+
+
+def build_engine(url: str) -> Engine | AsyncEngine:
+    if settings.db_async:
+        return create_async_engine(async_database_url(url), **engine_options(settings, TimedAsyncAdaptedQueuePool))
+    return create_engine(url, **engine_options(settings, TimedQueuePool))
+
+
+if settings.db_async:
+    async_engine = build_engine(DATABASE_URL)
+    # イベントやプールの統計は非同期エンジンの中の同期 Engine から取る
+    engine = async_engine.sync_engine
+else:
+    async_engine = None
+    engine = build_engine(DATABASE_URL)
+
+replica_engines = [build_engine(url) for url in settings.db_replica_urls]
+
+
+# /metrics 用に、使用中の接続数を checkout / checkin のイベントで数える (スクレイプ時にプールを見に行かない)
+def track_pool_metrics(engine: Engine | AsyncEngine, name: str) -> None:
+    sync_engine = engine.sync_engine if isinstance(engine, AsyncEngine) else engine
+    DB_POOL_CAPACITY.labels(name).set(settings.db_pool_size + settings.db_max_overflow)
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+    event.listen(sync_engine, "checkout", lambda *args: checked_out.inc())
+    event.listen(sync_engine, "checkin", lambda *args: checked_out.dec())
+
+
+track_pool_metrics(async_engine or engine, "primary")
+for index, replica_engine in enumerate(replica_engines):
+    track_pool_metrics(replica_engine, f"replica{index}")
+
+
+def _pool_stats(engine: Engine | AsyncEngine) -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+
+def pool_stats() -> dict:
+    return {
+        **_pool_stats(engine),
+        "max_overflow": settings.db_max_overflow,
+        "wait": pool_wait.snapshot(),
+        "replicas": [_pool_stats(replica) for replica in replica_engines],
+    }
+
+
+# 直前に書き込んだクライアントか (read-your-writes のためプライマリから読む)
+def is_sticky_to_primary(request: Request) -> bool:
+    try:
+        until = float(request.cookies.get(PRIMARY_STICKY_COOKIE, 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+# レプリカから読むセッションか (レプリカの内容は書き込みに遅れることがある)
+def is_replica_session(session: AnySession) -> bool:
+    return session.info.get("replica", False)
+
+
+# 書き込み用の get_session と GET 用の get_read_session を作る。
+# get_read_session はレプリカをラウンドロビンで選ぶが、get_session でコミットしたクライアントには
+# クッキーを付け、read_your_writes_seconds の間はプライマリから読ませる (レプリカの遅延対策)
+def make_session_dependencies(
+    primary: Engine | AsyncEngine, replicas: list[Engine | AsyncEngine], read_your_writes_seconds: float
+) -> tuple[Callable, Callable]:
+    next_replica = itertools.cycle(replicas).__next__ if replicas else None
+
+    def stick_to_primary(response: Response):
+        def after_commit(session: Session):
+            until = time.time() + read_your_writes_seconds
+            response.set_cookie(
+                PRIMARY_STICKY_COOKIE, str(until), max_age=math.ceil(read_your_writes_seconds), httponly=True, samesite="lax"
+            )
+        return after_commit
+
+    def read_engine(request: Request) -> Engine | AsyncEngine:
+        if next_replica is None or is_sticky_to_primary(request):
+            return primary
+        return next_replica()
+
+    if isinstance(primary, AsyncEngine):
+        async def get_session(response: Response):
+            async with AsyncSession(primary, expire_on_commit=False) as session:
+                if next_replica is not None:
+                    event.listen(session.sync_session, "after_commit", stick_to_primary(response))
+                yield session
+
+        async def get_read_session(request: Request):
+            engine = read_engine(request)
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                session.info["replica"] = engine is not primary
+                yield session
+    else:
+        def get_session(response: Response):
+            with Session(primary) as session:
+                if next_replica is not None:
+                    event.listen(session, "after_commit", stick_to_primary(response))
+                yield session
+
+        def get_read_session(request: Request):
+            engine = read_engine(request)
+            with Session(engine) as session:
+                session.info["replica"] = engine is not primary
+                yield session
+
+    return get_session, get_read_session
+
+
+get_session, get_read_session = make_session_dependencies(
+    async_engine or engine, replica_engines, settings.db_read_your_writes_seconds
+)
+
 
+# session を受け取る同期関数 fn を実行する。
+# AsyncSession なら run_sync でイベントループ上 (スレッドを使わず) に、
+# 同期 Session ならスレッドプールで実行するので、ルーターは async def のまま両方のモードで動く
+async def run_in_session(session: AnySession, fn: Callable[..., T], *args, **kwargs) -> T:
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, session, *args, **kwargs)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
 
+# StreamingResponse は依存関係のセッションが閉じた後も読み続けるので、同じエンジンに専用の接続を開く。
+# yield_per でサーバーサイドカーソルを使い、size 行ずつのまとまりを返すのでメモリ使用量は行数によらない
+def stream_partitions(session: AnySession, statement, size: int):
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(session, AsyncSession):
+        async def partitions():
+            async with session.bind.connect() as connection:
+                result = await connection.stream(statement)
+                async for partition in result.partitions():
+                    yield partition
+        return partitions()
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+    def partitions():
+        with session.get_bind().connect() as connection:
+            yield from connection.execute(statement).partitions()
+    return partitions()
@@ -0,0 +1,83 @@
+import asyncio
+import itertools
+from collections.abc import AsyncIterator
+from typing import Any, NamedTuple
+
+from pydantic_core import to_json
+
+from . import config
+from .metrics import EVENT_SUBSCRIBERS, EVENT_SUBSCRIBERS_DROPPED
+
+settings = config.get_settings()
+
+# 切断されたときに EventSource が再接続するまでの待ち時間
+RETRY_MILLISECONDS = 3000
+
+
+# 全購読者に同じバイト列を送るので、シリアライズは publish で1回だけ行う
+class Event(NamedTuple):
+    id: int
+    type: str
+    data: bytes
+
+
+class Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue[Event] = asyncio.Queue(queue_size)
+        self.dropped = False
+
+
+# プロセス内の pub/sub。publish はイベントループ上 (async のハンドラー) から呼び、待たずに各購読者のキューに入れる。
+# キューがあふれた購読者は切断し、再接続してフィードを読み直してもらう。
+# ワーカーをまたいで配信したい場合は Redis の pub/sub などで同じインターフェースを実装する
+class EventHub:
+    def __init__(self, queue_size: int, keepalive_seconds: float):
+        self.queue_size = queue_size
+        self.keepalive_seconds = keepalive_seconds
+        self._subscribers: set[Subscriber] = set()
+        self._ids = itertools.count(1)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        EVENT_SUBSCRIBERS.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+            EVENT_SUBSCRIBERS.dec()
+
+    def publish(self, type: str, data: Any) -> None:
+        event = Event(next(self._ids), type, to_json(data))
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+                EVENT_SUBSCRIBERS_DROPPED.inc()
+
+    # Server-Sent Events の本文。接続直後に retry を送ってヘッダーと一緒にすぐ届くようにし、
+    # 何も起きなくても keepalive_seconds ごとにコメントを送り、プロキシに切られないようにする
+    # (切断されていれば送信に失敗してここで終わる)
+    async def stream(self, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        try:
+            yield b"retry: %d\n\n" % RETRY_MILLISECONDS
+            while not (subscriber.dropped and subscriber.queue.empty()):
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"id: %d\nevent: %s\ndata: %s\n\n" % (event.id, event.type.encode(), event.data)
+            # 取りこぼしがあるので、クライアントはフィードを読み直してから再接続する
+            yield b"event: dropped\ndata: {}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+
+post_events = EventHub(settings.post_events_queue_size, settings.post_events_keepalive_seconds)
@@ -0,0 +1,47 @@
+import csv
+import io
+from datetime import datetime
+from typing import Literal
+
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
+
+ExportFormat = Literal["ndjson", "csv"]
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _ndjson(rows) -> bytes:
+    return b"".join(to_json(row._asdict()) + b"\n" for row in rows)
+
+
+def _csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+# database.stream_partitions の行のまとまりを1チャンクずつシリアライズして送る。
+# CSV は先頭にヘッダー行を付ける。同期/非同期どちらのイテレーターも受け取る
+def export_response(partitions, columns: list[str], format: ExportFormat, filename: str) -> StreamingResponse:
+    encode = _ndjson if format == "ndjson" else _csv
+    header = _csv([columns]) if format == "csv" else b""
+
+    if hasattr(partitions, "__aiter__"):
+        async def content():
+            if header:
+                yield header
+            async for partition in partitions:
+                yield encode(partition)
+    else:
+        def content():
+            if header:
+                yield header
+            for partition in partitions:
+                yield encode(partition)
+
+    return StreamingResponse(
+        content(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+    )
@@ -0,0 +1,64 @@
+from typing import NamedTuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import load_only
+
+
+# ?fields=id,title,user.name のような指定を、読み込む列と関連ごとの列に分けたもの
+class FieldSet(NamedTuple):
+    columns: list[str]
+    relations: dict[str, list[str]]
+
+    # キャッシュのキーや ETag に使う正規化した文字列
+    def key(self) -> str:
+        names = self.columns + [f"{relation}.{column}" for relation, columns in self.relations.items() for column in columns]
+        return ",".join(sorted(names))
+
+
+# columns は指定できる列、relations は指定できる関連とその列。
+# "user" のように関連名だけを指定した場合はその関連の全列を返す。知らない名前は 400 にする
+def parse_fields(fields: str | None, columns: list[str], relations: dict[str, list[str]]) -> FieldSet | None:
+    if not fields:
+        return None
+
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    if not names:
+        return None
+    unknown = []
+    for name in names:
+        relation, _, column = name.partition(".")
+        if column:
+            if column not in relations.get(relation, []):
+                unknown.append(name)
+        elif name not in columns and name not in relations:
+            unknown.append(name)
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    selected_relations = {}
+    for relation, relation_columns in relations.items():
+        if relation in names:
+            selected_relations[relation] = list(relation_columns)
+        elif any(f"{relation}.{column}" in names for column in relation_columns):
+            selected_relations[relation] = [column for column in relation_columns if f"{relation}.{column}" in names]
+    return FieldSet([column for column in columns if column in names], selected_relations)
+
+
+# 指定された列 (と extra の列) だけを SELECT するローダーオプション
+def load_columns(model, columns: list[str], *extra: str):
+    return load_only(*(getattr(model, name) for name in dict.fromkeys([*columns, *extra])))
+
+
+# 読み込んだ ORM オブジェクトから、指定された列と関連だけの dict を作る。
+# 関連を別のクエリでまとめて読み込んだ場合は related で渡す (遅延ロードさせないため)
+def project(obj, fieldset: FieldSet, **related) -> dict:
+    data = {column: getattr(obj, column) for column in fieldset.columns}
+    for relation, columns in fieldset.relations.items():
+        value = related[relation] if relation in related else getattr(obj, relation)
+        if isinstance(value, list):
+            data[relation] = [{column: getattr(item, column) for column in columns} for item in value]
+        elif value is None:
+            data[relation] = None
+        else:
+            data[relation] = {column: getattr(value, column) for column in columns}
+    return data
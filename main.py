@@ -2,14 +2,19 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from . import config
-from .database import create_db_and_tables
+from .compression import CompressionMiddleware
+from .metrics import MetricsMiddleware
+from .query_stats import QueryStatsMiddleware
 from .models.user_model import User
 from .models.post_model import Post
 
-from .routers import users, posts, oauth, sessions
+from .routers import users, posts, oauth, sessions, health, metrics
 
 settings = config.get_settings()
 
+# 既定の response_class のままにしておく。戻り値の型があるルートは FastAPI が pydantic-core で直接
+# JSON のバイト列にする (jsonable_encoder を通らない) ので、JSON を返すルートには必ず戻り値の型を書く。
+# ルーターで Response を組み立てる場合は serialization.PydanticJSONResponse を使う
 app = FastAPI()
 
 origins = [
@@ -24,22 +29,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_minimum_size,
+    encodings=settings.compression_encodings,
+    levels={
+        "gzip": settings.compression_gzip_level,
+        "br": settings.compression_brotli_level,
+        "zstd": settings.compression_zstd_level,
+    },
+)
+
+if settings.query_stats_enabled:
+    app.add_middleware(QueryStatsMiddleware, n_plus_one_threshold=settings.query_n_plus_one_threshold)
+
+app.add_middleware(MetricsMiddleware, streaming_paths=["/v1/posts/stream", "/v1/posts/export", "/v1/users/export"])
+
 app.include_router(users.router)
 app.include_router(oauth.router)
 app.include_router(posts.router)
 app.include_router(sessions.router)
-
-
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+app.include_router(health.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
-def read_root():
+def read_root() -> dict[str, str]:
     return {"Hello": "World"}
 
 
 @app.get("/items/{item_id}")
-def read_item(item_id: int, q: str | None = None):
+def read_item(item_id: int, q: str | None = None) -> dict[str, int | str | None]:
     return {"item_id": item_id, "q": q}
\ No newline at end of file
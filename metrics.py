@@ -0,0 +1,78 @@
+import os
+import time
+from collections.abc import Collection
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 複数ワーカーで動かすときは PROMETHEUS_MULTIPROC_DIR (起動前に空にしたディレクトリ) を設定する。
+# 各ワーカーは値をそこに mmap のファイルで書き、/metrics はどのワーカーが受けても全ワーカーの合計を返す
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# bcrypt やレイテンシの分布が見えるよう、既定より細かめにする
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP リクエストの処理時間", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "処理中の HTTP リクエスト数", ["method"], multiprocess_mode="livesum"
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_duration_seconds", "bcrypt のハッシュ化・照合にかかった時間", ["operation"], buckets=LATENCY_BUCKETS
+)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected", "待ち行列があふれて 503 にした bcrypt の要求数")
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "使用中の DB 接続数", ["engine"], multiprocess_mode="livesum"
+)
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_capacity_connections", "DB 接続数の上限 (pool_size + max_overflow)", ["engine"], multiprocess_mode="livesum"
+)
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "DB 接続の空き待ち時間", buckets=LATENCY_BUCKETS)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts", "DB 接続の空き待ちがタイムアウトした回数")
+CACHE_REQUESTS = Counter("post_cache_requests", "投稿のレスポンスキャッシュの参照数", ["result"])
+EVENT_SUBSCRIBERS = Gauge("post_event_subscribers", "投稿のイベント (SSE) の購読者数", multiprocess_mode="livesum")
+EVENT_SUBSCRIBERS_DROPPED = Counter("post_event_subscribers_dropped", "キューがあふれて切断した SSE の購読者数")
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# ルートごとのレイテンシと処理中のリクエスト数を記録する ASGI ミドルウェア。
+# ラベルには実際のパスではなくルートのパス (/v1/posts/{id}) を使い、系列が増えすぎないようにする。
+# SSE やエクスポートのように長く流し続けるパスは streaming_paths に渡して記録しない
+# (レイテンシの分布と処理中の数が接続時間で埋もれるため。SSE の接続数は post_event_subscribers で見る)
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, streaming_paths: Collection[str] = ()):
+        self.app = app
+        self.streaming_paths = frozenset(streaming_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.streaming_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(method, getattr(route, "path", "unmatched"), str(status)).observe(time.perf_counter() - started)
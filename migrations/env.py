@@ -0,0 +1,87 @@
+import importlib
+import importlib.util
+import sys
+from logging.config import fileConfig
+from pathlib import Path
+
+from alembic import context
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect, pool
+from sqlmodel import SQLModel
+
+ROOT = Path(__file__).resolve().parents[1]
+# アプリをパッケージとして読み込むときの名前。ディレクトリ名 (/code など) は標準ライブラリと衝突しうるので使わない
+PACKAGE = "blogapp"
+
+
+# アプリは相対 import のパッケージ (リポジトリのディレクトリ自体がパッケージ) なので、ファイルの場所から読み込む。
+# テストなどで既に読み込まれていればそれを使う (モデルを二重に定義しないため)
+def load_package() -> str:
+    init = str(ROOT / "__init__.py")
+    for name, module in list(sys.modules.items()):
+        if getattr(module, "__file__", None) == init:
+            return name
+    spec = importlib.util.spec_from_file_location(PACKAGE, init, submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = module
+    spec.loader.exec_module(module)
+    return PACKAGE
+
+
+package = load_package()
+database = importlib.import_module(f"{package}.database")
+importlib.import_module(f"{package}.models.post_model")
+importlib.import_module(f"{package}.models.user_model")
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# autogenerate で比較するモデル
+target_metadata = SQLModel.metadata
+
+# alembic.ini や -x url=... で指定されていなければアプリと同じ DB (同期ドライバ) を使う
+url = context.get_x_argument(as_dictionary=True).get("url") or config.get_main_option("sqlalchemy.url") or database.DATABASE_URL
+
+
+# autogenerate で比較しないもの。SQLite の FTS5 のテーブル (search.py がトリガーと一緒に作る) と、
+# MySQL の FULLTEXT のように ddl_if で DB を限定したインデックスのうち、ほかの DB 向けのもの
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    if type_ == "table" and name.startswith("post_fts"):
+        return False
+    ddl_if = getattr(object, "_ddl_if", None)
+    if ddl_if is not None and ddl_if.dialect is not None and ddl_if.dialect != context.get_context().dialect.name:
+        return False
+    return True
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=url, target_metadata=target_metadata, include_object=include_object, literal_binds=True, dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+# Alembic を入れる前に起動時の create_all で作った DB には alembic_version がないので、
+# テーブルがあればベースライン (0001) の状態とみなして記録し、そこから上げる
+def stamp_existing_schema(connection) -> None:
+    tables = set(inspect(connection).get_table_names())
+    if "alembic_version" not in tables and {"user", "post"} <= tables:
+        context.get_context().stamp(ScriptDirectory.from_config(config), "0001")
+
+
+def run_migrations_online() -> None:
+    engine = create_engine(url, poolclass=pool.NullPool)
+    with engine.connect() as connection:
+        # SQLite は ALTER TABLE が限られるので batch モード (テーブルを作り直す) で変更する
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object, render_as_batch=True)
+        with context.begin_transaction():
+            stamp_existing_schema(connection)
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
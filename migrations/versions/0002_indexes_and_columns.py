@@ -0,0 +1,134 @@
+"""indexes, constraints and columns added since the baseline
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-07-01 00:00:00
+
+- user: (email, provider) の一意制約 (ログイン・登録・OAuth の検索用インデックスを兼ねる)、
+  OAuth ユーザー用に password_digest を NULL 可にする
+- post: フィード用の (created_at, id)、ユーザーごとの投稿用の (user_id, created_at, id) インデックス
+- post: 一覧用の excerpt 列を追加して既存の投稿を埋める
+- post: 全文検索 (MySQL は ngram の FULLTEXT、SQLite は FTS5 とトリガー)
+"""
+from typing import Sequence
+
+from alembic import context, op
+import sqlalchemy as sa
+import sqlmodel
+
+
+revision: str = "0002"
+down_revision: str | None = "0001"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+EXCERPT_LENGTH = 120
+BACKFILL_BATCH_SIZE = 1000
+
+# search.py と同じもの。マイグレーションは後からアプリのコードが変わっても同じ結果になるよう写しておく
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, body, content='post', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+        INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+
+# models/post_model.make_excerpt と同じもの
+def make_excerpt(body: str) -> str:
+    text = " ".join(body.split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH - 1] + "…"
+
+
+def backfill_excerpts() -> None:
+    # 抜粋は Python で作るので、--sql (オフライン) では SQL を出力できない
+    if context.is_offline_mode():
+        op.execute("-- excerpt の埋め込みはオフラインでは行わない。alembic upgrade をオンラインで実行すること")
+        return
+    bind = op.get_bind()
+    post = sa.table("post", sa.column("id", sa.Integer), sa.column("body", sa.TEXT), sa.column("excerpt", sa.String))
+    update = post.update().where(post.c.id == sa.bindparam("post_id")).values(excerpt=sa.bindparam("post_excerpt"))
+    last_id = 0
+    while True:
+        statement = sa.select(post.c.id, post.c.body).where(post.c.id > last_id).order_by(post.c.id).limit(BACKFILL_BATCH_SIZE)
+        rows = bind.execute(statement).all()
+        if not rows:
+            break
+        bind.execute(update, [{"post_id": id, "post_excerpt": make_excerpt(body or "")} for id, body in rows])
+        last_id = rows[-1].id
+
+
+# (email, provider) が重複したユーザーがいると一意制約を作れないので、どれを残すかを決めてもらうために先に止める
+def check_duplicate_users() -> None:
+    if context.is_offline_mode():
+        op.execute("-- (email, provider) が重複したユーザーがいると、この後の一意制約の作成に失敗する")
+        return
+    user = sa.table("user", sa.column("email", sa.String), sa.column("provider", sa.String))
+    statement = (
+        sa.select(user.c.email, user.c.provider, sa.func.count().label("count"))
+        .group_by(user.c.email, user.c.provider)
+        .having(sa.func.count() > 1)
+        .limit(10)
+    )
+    duplicates = op.get_bind().execute(statement).all()
+    if duplicates:
+        listed = ", ".join(f"{email} ({provider}) x{count}" for email, provider, count in duplicates)
+        raise RuntimeError(
+            f"Duplicate users for (email, provider): {listed}. Merge or delete them before upgrading to 0002."
+        )
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+
+    check_duplicate_users()
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.alter_column("password_digest", existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=True)
+        batch_op.create_unique_constraint("uq_user_email_provider", ["email", "provider"])
+
+    with op.batch_alter_table("post") as batch_op:
+        batch_op.add_column(sa.Column("excerpt", sqlmodel.sql.sqltypes.AutoString(length=EXCERPT_LENGTH), nullable=False, server_default=""))
+    backfill_excerpts()
+    with op.batch_alter_table("post") as batch_op:
+        batch_op.alter_column("excerpt", existing_type=sqlmodel.sql.sqltypes.AutoString(length=EXCERPT_LENGTH), server_default=None)
+
+    op.create_index("ix_post_created_at_id", "post", ["created_at", "id"])
+    op.create_index("ix_post_user_id_created_at", "post", ["user_id", "created_at", "id"])
+
+    if dialect == "mysql":
+        op.create_index("ix_post_title_body_fulltext", "post", ["title", "body"], mysql_prefix="FULLTEXT", mysql_with_parser="ngram")
+    if dialect == "sqlite":
+        # SQLite の batch モードは post を作り直すので、トリガーは最後に作って既存の投稿から索引を作る
+        for ddl in SQLITE_FTS_DDL:
+            op.execute(ddl)
+        op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        for trigger in ["post_fts_insert", "post_fts_delete", "post_fts_update"]:
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS post_fts")
+    if dialect == "mysql":
+        op.drop_index("ix_post_title_body_fulltext", table_name="post")
+
+    op.drop_index("ix_post_user_id_created_at", table_name="post")
+    op.drop_index("ix_post_created_at_id", table_name="post")
+    with op.batch_alter_table("post") as batch_op:
+        batch_op.drop_column("excerpt")
+
+    # password_digest のない OAuth ユーザーがいると NOT NULL に戻せないので、先に削除しておく必要がある
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.drop_constraint("uq_user_email_provider", type_="unique")
+        batch_op.alter_column("password_digest", existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=False)
@@ -0,0 +1,44 @@
+"""user post_count and last_posted_at
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-08-01 00:00:00
+
+- user: 投稿数 (post_count) と最新の投稿日時 (last_posted_at) を追加し、既存の投稿から埋める。
+  以降は投稿の書き込みと一緒に post_stats.py が更新する
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0003"
+down_revision: str | None = "0002"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.add_column(sa.Column("post_count", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("last_posted_at", sa.DateTime(), nullable=True))
+
+    # SQL だけで埋められるので --sql (オフライン) でも出力できる
+    user = sa.table("user", sa.column("id", sa.Integer), sa.column("post_count", sa.Integer), sa.column("last_posted_at", sa.DateTime))
+    post = sa.table("post", sa.column("user_id", sa.Integer), sa.column("created_at", sa.DateTime))
+    op.execute(
+        user.update().values(
+            post_count=sa.select(sa.func.count()).select_from(post).where(post.c.user_id == user.c.id).scalar_subquery(),
+            last_posted_at=sa.select(sa.func.max(post.c.created_at)).where(post.c.user_id == user.c.id).scalar_subquery(),
+        )
+    )
+
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.alter_column("post_count", existing_type=sa.Integer(), server_default=None)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.drop_column("last_posted_at")
+        batch_op.drop_column("post_count")
@@ -1,11 +1,22 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 from datetime import datetime
 
-from sqlmodel import Column, Field, Relationship, SQLModel, TEXT
+from sqlalchemy.orm import load_only
+from sqlmodel import Column, Field, Index, Relationship, SQLModel, TEXT
 
 if TYPE_CHECKING:
     from .user_model import User
 
+EXCERPT_LENGTH = 120
+
+
+# 一覧に出す本文の抜粋。改行や連続する空白は1つにまとめる
+def make_excerpt(body: str) -> str:
+    text = " ".join(body.split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH - 1] + "…"
+
 
 class PostBase(SQLModel):
     title: str = Field(max_length=50)
@@ -16,7 +27,18 @@ class PostBase(SQLModel):
 
 
 class Post(PostBase, table=True):
+    __table_args__ = (
+        # フィードのキーセットページネーション (created_at, id) をインデックスの範囲検索にする
+        Index("ix_post_created_at_id", "created_at", "id"),
+        # ユーザーごとの新しい投稿 (/users の posts_limit) を user_id の範囲検索で読む
+        Index("ix_post_user_id_created_at", "user_id", "created_at", "id"),
+        # 全文検索用。日本語を分かち書きせずに引けるよう ngram パーサーを使う (SQLite は search.py の FTS5)
+        Index("ix_post_title_body_fulltext", "title", "body", mysql_prefix="FULLTEXT", mysql_with_parser="ngram").ddl_if(dialect="mysql"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
+    # 一覧では TEXT の body を読まずにこれを返す。作成・更新時に make_excerpt で作り直す
+    excerpt: str = Field(default="", max_length=EXCERPT_LENGTH)
 
     user: "User" = Relationship(back_populates="posts")
 
@@ -29,6 +51,29 @@ class PostPublic(PostBase):
     id: int
 
 
+class PostSummary(SQLModel):
+    id: int
+    title: str
+    excerpt: str
+    user_id: int
+    created_at: datetime
+    updated_at: datetime
+
+
+# PostSummary の列だけを読み込むローダーオプション (body は SELECT しない)
+def load_summary_only():
+    return load_only(*(getattr(Post, name) for name in PostSummary.model_fields))
+
+
+# 一括作成。要素ごとにエラーを返せるよう、各要素 (オブジェクトでないものも) は受け取ってから PostCreate で検証する
+class PostBulkCreate(SQLModel):
+    items: list[Any] = Field(min_length=1)
+
+
+class PostBulkDelete(SQLModel):
+    ids: list[int] = Field(min_length=1)
+
+
 class PostUpdate(SQLModel):
     title: str | None = Field(default=None, max_length=50)
     body: str | None = Field(default=None, sa_column=Column(TEXT), max_length=10000)
@@ -1,10 +1,65 @@
-from .post_model import PostPublic
-from .user_model import UserPublic
+from sqlmodel import SQLModel
+
+from .post_model import PostPublic, PostSummary
+from .user_model import UserPublic, UserPublicWithStats
 
 
 class UserPublicWithPosts(UserPublic):
     posts: list[PostPublic]
 
 
+class UserPublicWithPostSummaries(UserPublic):
+    posts: list[PostSummary]
+
+
+class UserPageWithPosts(SQLModel):
+    items: list[UserPublicWithPosts] | list[UserPublicWithPostSummaries]
+    next_cursor: str | None = None
+
+
+class UserPageWithStats(SQLModel):
+    items: list[UserPublicWithStats]
+    next_cursor: str | None = None
+
+
+class UserBatchWithPosts(SQLModel):
+    items: list[UserPublicWithPosts] | list[UserPublicWithPostSummaries]
+    missing: list[int]
+
+
 class PostPublicWithUser(PostPublic):
-    user: UserPublic | None = None
\ No newline at end of file
+    user: UserPublic | None = None
+
+
+class PostSummaryWithUser(PostSummary):
+    user: UserPublic | None = None
+
+
+class PostPageWithUser(SQLModel):
+    items: list[PostSummaryWithUser]
+    next_cursor: str | None = None
+
+
+class PostBatchWithUser(SQLModel):
+    items: list[PostPublicWithUser]
+    missing: list[int]
+
+
+class PostSearchHit(PostSummary):
+    score: float
+    snippet: str
+    user: UserPublic | None = None
+
+
+class PostSearchResults(SQLModel):
+    items: list[PostSearchHit]
+    next_offset: int | None = None
+
+
+class PostBulkCreated(SQLModel):
+    ids: list[int]
+
+
+class PostBulkDeleted(SQLModel):
+    deleted: list[int]
+    missing: list[int]
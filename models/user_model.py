@@ -2,7 +2,7 @@ from typing import TYPE_CHECKING
 from datetime import datetime
 
 from pydantic import EmailStr, field_validator, ValidationInfo
-from sqlmodel import Field, Relationship, SQLModel
+from sqlmodel import Field, Relationship, SQLModel, UniqueConstraint
 
 if TYPE_CHECKING:
     from .post_model import Post
@@ -18,8 +18,14 @@ class UserBase(SQLModel):
 
 
 class User(UserBase, table=True):
+    __table_args__ = (UniqueConstraint("email", "provider", name="uq_user_email_provider"),)
+
     id: int | None = Field(default=None, primary_key=True)
-    password_digest: str = Field()
+    # OAuth ユーザーはローカルのパスワードを持たないので None
+    password_digest: str | None = Field(default=None)
+    # 投稿数と最新の投稿日時。投稿を読まずに出せるよう post_stats.py で投稿の書き込みと一緒に更新する
+    post_count: int = Field(default=0)
+    last_posted_at: datetime | None = Field(default=None)
 
     posts: list["Post"] = Relationship(back_populates="user", cascade_delete=True)
 
@@ -43,6 +49,11 @@ class UserPublic(UserBase):
     id: int
 
 
+class UserPublicWithStats(UserPublic):
+    post_count: int
+    last_posted_at: datetime | None = None
+
+
 class UserUpdate(SQLModel):
     name: str | None = Field(default=None, min_length=2, max_length=50)
     email: EmailStr | None = Field(default=None, max_length=254)
@@ -0,0 +1,54 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# ?ids= で一度に引ける件数の上限 (IN 句とレスポンスが大きくなりすぎないように)
+MAX_BATCH_IDS = 100
+# 主キーは BIGINT (符号付き 64 ビット) に収まる正の整数
+MAX_ID = 2**63 - 1
+
+
+# ソートキー (例: created_at, id) を外部からは中身の見えないカーソル文字列にする
+def encode_cursor(*keys: datetime | int) -> str:
+    values = [key.isoformat() if isinstance(key, datetime) else key for key in keys]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# カーソル文字列を types の型のソートキーに戻す。壊れたカーソルと、BIGINT に収まらない id は 400 にする
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        keys = tuple(
+            datetime.fromisoformat(value) if type_ is datetime else type_(value)
+            for type_, value in zip(types, values)
+        )
+        if any(isinstance(key, int) and not 1 <= key <= MAX_ID for key in keys):
+            raise ValueError(cursor)
+        return keys
+    except (ValueError, TypeError, OverflowError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+# ?ids=1,2,3 を id のリストにする。重複は最初の位置だけ残し、並び順は保つ。
+# 数値でないもの・BIGINT に収まらないもの・上限を超える件数は 400 にする。
+# conflicting には ids と一緒に使えない他のクエリパラメータ (limit や cursor など) を渡す
+def parse_ids(ids: str, *conflicting) -> list[int]:
+    if any(param is not None for param in conflicting):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids cannot be combined with other filters or pagination")
+    try:
+        values = list(dict.fromkeys(int(id) for id in ids.split(",") if id.strip()))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid ids")
+    if any(not 1 <= value <= MAX_ID for value in values):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid ids")
+    if not values or len(values) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"ids must contain 1 to {MAX_BATCH_IDS} ids")
+    return values
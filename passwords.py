@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from . import config
+from .metrics import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+
+settings = config.get_settings()
+
+
+# bcrypt のハッシュ化・照合を AnyIO の共有スレッドプールとは別の専用スレッドで実行する。
+# 実行中 + 待ち行列の件数が max_pending を超えたら待たせずに 503 を返し、
+# ログインが集中しても他のエンドポイントのスレッドを食い潰さないようにする。
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.completed = {"hash": 0, "verify": 0}
+        self.seconds = {"hash": 0.0, "verify": 0.0}
+
+    def _run(self, operation: str, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.pending -= 1
+                self.completed[operation] += 1
+                self.seconds[operation] += elapsed
+            self._slots.release()
+            PASSWORD_HASH_SECONDS.labels(operation).observe(elapsed)
+
+    def _submit(self, operation: str, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": "1"},
+            )
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._run, operation, fn, *args)
+
+    def hash(self, password: str) -> str:
+        return self._submit("hash", self.context.hash, password).result()
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return self._submit("verify", self.context.verify, plain_password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit("hash", self.context.hash, password))
+
+    async def verify_async(self, plain_password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self._submit("verify", self.context.verify, plain_password, hashed_password))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "rejected": self.rejected,
+                "completed": dict(self.completed),
+                "seconds": dict(self.seconds),
+            }
+
+
+hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_max_pending)
+
+
+# ユーザーが入力したパスワードをハッシュ化したバスワードにする
+def get_password_hash(password: str) -> str:
+    return hasher.hash(password)
+
+
+# ユーザーが入力したパスワードとハッシュ化したパスワードが一致するか確認する
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return hasher.verify(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hasher.hash_async(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await hasher.verify_async(plain_password, hashed_password)
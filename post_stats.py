@@ -0,0 +1,121 @@
+# User.post_count と User.last_posted_at (投稿数と最新の投稿日時) の維持と修復。
+# 投稿の作成・削除・投稿者の付け替えと同じトランザクションで更新する。件数は読み込まずに
+# post_count + n の UPDATE で増減させるので、同じユーザーへの書き込みが同時に来ても数え漏れない。
+# ずれた場合 (直接 DB を書き換えた、古いバージョンで書き込んだなど) は定期的に修復ジョブを流す:
+#   python -m <パッケージ名>.post_stats --batch-size 1000
+import argparse
+import sys
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, case, update
+from sqlmodel import Session, func, or_, select
+
+from .database import engine
+from .models.post_model import Post
+from .models.user_model import User
+
+RECONCILE_BATCH_SIZE = 1000
+
+
+# 投稿者の実際の投稿数と最新の created_at。UPDATE user の中では更新する行に相関する。
+# どちらも (user_id, created_at, id) のインデックスで引ける
+def actual_post_count():
+    return select(func.count(Post.id)).where(Post.user_id == User.id).scalar_subquery()
+
+
+def actual_last_posted_at():
+    return select(func.max(Post.created_at)).where(Post.user_id == User.id).scalar_subquery()
+
+
+# UPDATE は user の行をパラメーターの順にロックするので、同時に走る一括作成・削除の間でデッドロックしないよう
+# どの更新も user_id の昇順で行う
+
+
+# 投稿者ごとの (追加した件数, 追加した投稿の最新の created_at) を1回の executemany で足す
+def add_posts(session: Session, posts: list[tuple[int, datetime]]) -> None:
+    stats: dict[int, tuple[int, datetime]] = {}
+    for user_id, created_at in posts:
+        count, latest = stats.get(user_id, (0, created_at))
+        stats[user_id] = (count + 1, max(latest, created_at))
+    if not stats:
+        return
+
+    latest = bindparam("stats_latest", type_=User.last_posted_at.type)
+    statement = (
+        update(User)
+        .where(User.id == bindparam("stats_user_id"))
+        .values(
+            post_count=User.post_count + bindparam("stats_count"),
+            last_posted_at=case(
+                (or_(User.last_posted_at.is_(None), User.last_posted_at < latest), latest), else_=User.last_posted_at
+            ),
+        )
+    )
+    session.connection().execute(
+        statement,
+        [{"stats_user_id": user_id, "stats_count": count, "stats_latest": latest} for user_id, (count, latest) in sorted(stats.items())],
+    )
+
+
+# 削除した (付け替えで外れた分を含む) 投稿の投稿者ごとに件数を引き、最新の投稿日時は残った投稿から求め直す。
+# 残った投稿を読むので、呼ぶ前に削除を flush しておくこと
+def remove_posts(session: Session, user_ids: list[int]) -> None:
+    counts = Counter(user_ids)
+    if not counts:
+        return
+
+    statement = (
+        update(User)
+        .where(User.id == bindparam("stats_user_id"))
+        .values(post_count=User.post_count - bindparam("stats_count"), last_posted_at=actual_last_posted_at())
+    )
+    session.connection().execute(
+        statement, [{"stats_user_id": user_id, "stats_count": count} for user_id, count in sorted(counts.items())]
+    )
+
+
+# 全ユーザーを id 順に batch_size 件ずつ実際の投稿と突き合わせ、ずれていたユーザーだけ数え直す。
+# バッチごとにコミットするので長いロックを取らない。直したユーザーの数を返す
+def reconcile_post_stats(session: Session, batch_size: int = RECONCILE_BATCH_SIZE) -> int:
+    fixed = 0
+    last_id = 0
+    while True:
+        statement = select(User.id, User.post_count, User.last_posted_at).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        users = session.exec(statement).all()
+        if not users:
+            return fixed
+
+        ids = [user.id for user in users]
+        actual = {
+            user_id: (count, latest)
+            for user_id, count, latest in session.exec(
+                select(Post.user_id, func.count(Post.id), func.max(Post.created_at)).where(Post.user_id.in_(ids)).group_by(Post.user_id)
+            )
+        }
+        drifted = [user.id for user in users if (user.post_count, user.last_posted_at) != actual.get(user.id, (0, None))]
+        if drifted:
+            # 読んだ値を書き戻すと、その間に作られた投稿の分が消えるので、UPDATE の中で数え直す
+            session.connection().execute(
+                update(User)
+                .where(User.id.in_(drifted))
+                .values(post_count=actual_post_count(), last_posted_at=actual_last_posted_at())
+            )
+        session.commit()
+        fixed += len(drifted)
+        last_id = ids[-1]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="User.post_count と last_posted_at を実際の投稿から修復する")
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    with Session(engine) as session:
+        fixed = reconcile_post_stats(session, args.batch_size)
+    sys.stdout.write(f"fixed {fixed} users\n")
+    return fixed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# IN (?, ?, ?) の個数やリテラルの違いを無視して、同じ形の SQL をまとめる
+PLACEHOLDER_LIST = re.compile(r"\(\s*(\?|%s|%\(\w+\)s|:\w+)(\s*,\s*(\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    return WHITESPACE.sub(" ", PLACEHOLDER_LIST.sub("(?)", statement)).strip()
+
+
+# 1リクエストで実行した SQL の件数・合計時間・いちばん遅い SQL
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement: str | None = None
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+        self.shapes[statement_shape(statement)] += 1
+
+    # 同じ形の SQL が threshold 回以上繰り返されていれば N+1 の疑いとして (形, 回数) を返す
+    def repeated(self, threshold: int) -> tuple[str, int] | None:
+        if not self.shapes:
+            return None
+        shape, count = self.shapes.most_common(1)[0]
+        return (shape, count) if count >= threshold else None
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries", '
+            f"db-slowest;dur={self.slowest_seconds * 1000:.1f}"
+        )
+
+
+current_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+# すべてのエンジン (非同期エンジンの sync_engine も含む) の SQL を、実行中のリクエストの QueryStats に記録する。
+# run_in_threadpool / run_sync は contextvars を引き継ぐので、どちらのモードでも同じリクエストに集計される。
+# 開始時刻は実行ごとの context に持たせる (失敗した SQL の分がプールの接続に残らないように)
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats.get() is not None and context is not None:
+        context._query_stats_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats.get()
+    started = getattr(context, "_query_stats_started", None)
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+# リクエストごとに QueryStats を用意し、レスポンスヘッダーに X-Query-Count と Server-Timing を付ける。
+# 同じ形の SQL が n_plus_one_threshold 回以上あれば X-Query-Repeated を付けて警告のログを出す
+class QueryStatsMiddleware:
+    def __init__(self, app: ASGIApp, n_plus_one_threshold: int):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_stats.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Query-Count"] = str(stats.count)
+                headers.append("Server-Timing", stats.server_timing())
+                repeated = stats.repeated(self.n_plus_one_threshold)
+                if repeated is not None:
+                    shape, count = repeated
+                    headers["X-Query-Repeated"] = str(count)
+                    logger.warning("Possible N+1 on %s %s: %d x %s", scope["method"], scope["path"], count, shape)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_stats.reset(token)
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+
+from ..database import pool_stats
+from ..passwords import hasher
+
+router = APIRouter(
+    prefix="/health",
+    tags=["health"],
+)
+
+
+# ワーカー数やプールサイズを MySQL の max_connections に合わせて決めるための統計
+@router.get("/pool")
+def read_pool_stats() -> dict:
+    return {"database": pool_stats(), "password_hasher": hasher.stats()}
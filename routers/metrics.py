@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Response
+
+from ..metrics import render_metrics
+
+router = APIRouter(
+    tags=["metrics"],
+)
+
+
+# Prometheus がスクレイプする。レイテンシ、処理中のリクエスト、bcrypt、DB プール、キャッシュのヒット率
+@router.get("/metrics", include_in_schema=False)
+def read_metrics() -> Response:
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
@@ -1,13 +1,12 @@
-import random
-import string
-
 from typing import Annotated
 
 from fastapi import APIRouter, Depends
-from passlib.context import CryptContext
+from sqlalchemy import insert
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select, Session
 
-from ..database import get_session
+from ..database import AnySession, get_session, run_in_session
 from ..models.user_model import User, UserPublic, OAuthUserCreate
 
 router = APIRouter(
@@ -15,32 +14,46 @@ router = APIRouter(
     tags=["oauth"],
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-def generate_random_password(length: int = 12) -> str:
-    characters = string.ascii_letters + string.digits + string.punctuation
-    return ''.join(random.choice(characters) for i in range(length))
 
+# (email, provider) が既にあれば何もしない INSERT を DB の方言ごとに組み立てる。対応していない DB では None
+def build_oauth_user_upsert(dialect_name: str, values: dict):
+    if dialect_name == "mysql":
+        statement = mysql.insert(User).values(values)
+        return statement.on_duplicate_key_update(email=statement.inserted.email)
+    if dialect_name == "postgresql":
+        return postgresql.insert(User).values(values).on_conflict_do_nothing(index_elements=["email", "provider"])
+    if dialect_name == "sqlite":
+        return sqlite.insert(User).values(values).on_conflict_do_nothing(index_elements=["email", "provider"])
+    return None
+
+
+# 同時に初回ログインが来ても一意制約と upsert で重複ユーザーを作らない。upsert のない DB では
+# 素の INSERT にし、先に作られて一意制約に当たったらロールバックする (どちらの場合も呼び出し側で読み直す)
+def insert_oauth_user(session: Session, dialect_name: str, values: dict) -> None:
+    upsert = build_oauth_user_upsert(dialect_name, values)
+    if upsert is not None:
+        session.execute(upsert)
+        session.commit()
+        return
+    try:
+        session.execute(insert(User).values(values))
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+
+
+def _create_oauth_user(session: Session, user: OAuthUserCreate) -> UserPublic:
+    # ユーザーが既に存在しているかチェック (2回目以降のログインはこの1クエリだけ)
+    statement = select(User).where(User.email == user.email, User.provider == user.provider)
+    is_existing_user = session.exec(statement).first()
+    if is_existing_user:
+        return UserPublic.model_validate(is_existing_user)
 
-# ユーザーが入力したパスワードをハッシュ化したバスワードにする
-def get_password_hash(password):
-    return pwd_context.hash(password)
+    # OAuth ユーザーはパスワードでログインしないので bcrypt は使わない
+    insert_oauth_user(session, session.get_bind().dialect.name, user.model_dump())
+    return UserPublic.model_validate(session.exec(statement).one())
 
 
 @router.post("/oauth")
-def create_oauth_user(*, session: Annotated[Session, Depends(get_session)], user: OAuthUserCreate) -> UserPublic:
-    # ユーザーが既に存在しているかチェック
-    is_existing_user = session.exec(select(User).where(User.email == user.email, User.provider == user.provider)).first()
-    if is_existing_user:
-        return is_existing_user
-    
-    random_password = generate_random_password()
-    password_digest = get_password_hash(random_password)
-    extra_data = {"password_digest": password_digest}
-    db_user = User.model_validate(user, update=extra_data)
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
-    return db_user
-    
\ No newline at end of file
+async def create_oauth_user(*, session: Annotated[AnySession, Depends(get_session)], user: OAuthUserCreate) -> UserPublic:
+    return await run_in_session(session, _create_oauth_user, user)
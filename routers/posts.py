@@ -1,61 +1,468 @@
 from typing import Annotated
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import desc, select, Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from pydantic_core import to_json
+from sqlalchemy import delete, insert, null, text
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel import and_, desc, or_, select, Session
 
-from ..database import get_session
-from ..models.post_model import Post, PostCreate, PostUpdate, PostPublic
-from ..models.responses import PostPublicWithUser
+from .. import config
+from ..cache import CachedResponse, post_cache
+from ..conditional import has_conditional_headers, is_not_modified, latest, make_etag, not_modified_response, validator_headers
+from ..database import (
+    AnySession, get_read_session, get_session, is_replica_session, is_sticky_to_primary, run_in_session, stream_partitions
+)
+from ..events import post_events
+from ..exports import ExportFormat, export_response
+from ..fieldsets import FieldSet, load_columns, parse_fields, project
+from ..models.post_model import (
+    Post, PostBulkCreate, PostBulkDelete, PostCreate, PostUpdate, PostPublic, PostSummary, load_summary_only, make_excerpt
+)
+from ..models.user_model import User, UserPublic
+from ..models.responses import (
+    PostBatchWithUser, PostBulkCreated, PostBulkDeleted, PostPageWithUser, PostPublicWithUser, PostSearchHit, PostSearchResults, PostSummaryWithUser
+)
+from ..post_stats import add_posts, remove_posts
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor, parse_ids
+from ..search import highlight, query_terms, search_statement
+
+settings = config.get_settings()
 
 router = APIRouter(
     prefix="/v1",
     tags=["posts"],
 )
 
+# 関連度順の検索は深いページほど重くなるので offset に上限を設ける
+MAX_SEARCH_OFFSET = 1000
 
-@router.post("/posts")
-def create_post(*, session: Annotated[Session, Depends(get_session)], post: PostCreate) -> PostPublic:
-    db_post = Post.model_validate(post)
+# ?fields= で指定できる列。一覧は要約の列、詳細は本文を含む列と投稿者 (user.name など)
+FEED_FIELDS = list(PostSummary.model_fields)
+POST_FIELDS = list(PostPublic.model_fields)
+POST_RELATIONS = {"user": list(UserPublic.model_fields)}
+
+EXPORT_COLUMNS = ["id", "user_id", "title", "body", "excerpt", "created_at", "updated_at"]
+
+
+# key のキャッシュがあればそれを返し、なければ read で DB から読んでシリアライズしたものをキャッシュする。
+# If-None-Match / If-Modified-Since に一致すれば本文を送らずに 304 を返す。キャッシュがないときは
+# validate で (id, updated_at) だけを読んで判定するので、本文の読み込みもシリアライズもしない。
+# 直前に書き込んだクライアントはプライマリから最新を読むので、キャッシュを読みも書きもしない。
+# 書き込みの直後にレプリカから読んだ内容は古いかもしれないので、キャッシュに入れない
+async def conditional_response(request: Request, key: str, session: AnySession, read, validate, *args) -> Response:
+    sticky = is_sticky_to_primary(request)
+    entry = None if sticky else await post_cache.get(key)
+    if entry is None:
+        if has_conditional_headers(request):
+            etag, last_modified = await run_in_session(session, validate, *args)
+            if is_not_modified(request, etag, last_modified):
+                return not_modified_response(etag, last_modified)
+        result, etag, last_modified = await run_in_session(session, read, *args)
+        entry = CachedResponse(etag, last_modified, to_json(result))
+        if not sticky and not (is_replica_session(session) and await post_cache.recently_written()):
+            await post_cache.set(key, entry)
+    elif is_not_modified(request, entry.etag, entry.last_modified):
+        return not_modified_response(entry.etag, entry.last_modified)
+    return Response(content=entry.content, media_type="application/json", headers=validator_headers(entry.etag, entry.last_modified))
+
+
+# 投稿と投稿者の (id, updated_at) の並びから ETag と Last-Modified を作る
+def post_validators(rows: list[tuple[int, datetime, datetime | None]], *params) -> tuple[str, datetime | None]:
+    etag = make_etag(*params, *(part for row in rows for part in row))
+    return etag, latest(*(updated_at for row in rows for updated_at in row[1:]))
+
+
+# 一覧の ETag。ページに含める行とその次があるかだけから作り、ページの外の行の変更では変わらないようにする。
+# 一覧は削除や新しくない created_at の挿入でも最新の updated_at が進まないので、Last-Modified は付けない
+def collection_validators(rows: list, has_more: bool, *params) -> tuple[str, None]:
+    etag, _ = post_validators(rows, has_more, *params)
+    return etag, None
+
+
+# fields で投稿者を返さない場合は、投稿者の更新で ETag が変わらないようにする
+def _post_version(post: Post, fieldset: FieldSet | None) -> tuple[int, datetime, datetime | None]:
+    with_user = fieldset is None or "user" in fieldset.relations
+    return post.id, post.updated_at, post.user.updated_at if with_user and post.user else None
+
+
+def _validator_statement(fieldset: FieldSet | None):
+    if fieldset is not None and "user" not in fieldset.relations:
+        return select(Post.id, Post.updated_at, null())
+    return select(Post.id, Post.updated_at, User.updated_at).outerjoin(User, Post.user_id == User.id)
+
+
+# fields で指定された列だけを SELECT するローダーオプション。投稿者を返さないなら投稿者は読み込まない。
+# ETag 用の updated_at、カーソル用の created_at、投稿者の読み込みに使う user_id は常に読む
+def _post_load_options(fieldset: FieldSet, user_loader) -> list:
+    options = [load_columns(Post, fieldset.columns, "created_at", "updated_at", "user_id")]
+    if "user" in fieldset.relations:
+        options.append(user_loader(Post.user).options(load_columns(User, fieldset.relations["user"], "updated_at")))
+    return options
+
+
+def _fields_key(fieldset: FieldSet | None) -> str:
+    return fieldset.key() if fieldset else ""
+
+
+# 以下の _ で始まる関数は同期 Session で DB を操作し、レスポンス用のモデルまで作って返す。
+# ハンドラーは run_in_session でこれを呼ぶだけなので、同期/非同期どちらのエンジンでも async def で動く
+
+
+# SSE で送る投稿はフィードと同じ要約にする (本文は送らない)
+def _event_summary(post: PostPublic) -> PostSummary:
+    return PostSummary(**post.model_dump(exclude={"body"}), excerpt=make_excerpt(post.body))
+
+
+def _create_post(session: Session, post: PostCreate) -> PostPublic:
+    db_post = Post.model_validate(post, update={"excerpt": make_excerpt(post.body)})
     session.add(db_post)
+    add_posts(session, [(db_post.user_id, db_post.created_at)])
     session.commit()
     session.refresh(db_post)
+    return PostPublic.model_validate(db_post)
+
+
+@router.post("/posts")
+async def create_post(*, session: Annotated[AnySession, Depends(get_session)], post: PostCreate) -> PostPublic:
+    db_post = await run_in_session(session, _create_post, post)
+    await post_cache.invalidate_posts(db_post.id)
+    post_events.publish("create", _event_summary(db_post))
     return db_post
 
 
+# 全件を検証してから INSERT する。エラーは要素の番号ごとにまとめ、1件でもあれば何も作らずに 422 を返す
+def _validate_bulk_posts(session: Session, items: list) -> list[dict]:
+    rows: list[tuple[int, PostCreate]] = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            rows.append((index, PostCreate.model_validate(item)))
+        except ValidationError as e:
+            errors.append({"index": index, "errors": e.errors(include_url=False, include_context=False, include_input=False)})
+
+    # 投稿者の存在は1クエリでまとめて確認する
+    user_ids = {post.user_id for _, post in rows}
+    existing_user_ids = set(session.exec(select(User.id).where(User.id.in_(user_ids))).all()) if user_ids else set()
+    for index, post in rows:
+        if post.user_id not in existing_user_ids:
+            errors.append({"index": index, "errors": [{"type": "not_found", "loc": ["user_id"], "msg": "User not found"}]})
+    if errors:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=sorted(errors, key=lambda error: error["index"]))
+    return [{**post.model_dump(), "excerpt": make_excerpt(post.body)} for _, post in rows]
+
+
+# RETURNING のない DB (MySQL) で、複数行の INSERT が振った id を求める。lastrowid は最初の行の id で、
+# 件数が決まっている INSERT では auto_increment_increment ずつ増えていくはずだが、設定 (innodb_autoinc_lock_mode など) に
+# よっては保証されないので、読み直して自分の行であることを確かめる。違えば例外にしてトランザクションごと取り消す
+def _inserted_ids(connection, first_id: int, batch: list[dict]) -> list[int]:
+    increment = connection.execute(text("SELECT @@auto_increment_increment")).scalar()
+    ids = list(range(first_id, first_id + len(batch) * increment, increment))
+    rows = connection.execute(select(Post.id, Post.title, Post.user_id).where(Post.id.in_(ids)).order_by(Post.id)).all()
+    if [(row.title, row.user_id) for row in rows] != [(item["title"], item["user_id"]) for item in batch] or [row.id for row in rows] != ids:
+        raise RuntimeError("Could not determine the ids of bulk-inserted posts; AUTO_INCREMENT values were not consecutive")
+    return ids
+
+
+# batch_size 件ずつ複数行の INSERT にまとめ、1トランザクションでコミットする
+def _create_posts(session: Session, items: list, batch_size: int) -> PostBulkCreated:
+    rows = _validate_bulk_posts(session, items)
+    connection = session.connection()
+    ids = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        statement = insert(Post).values(batch)
+        if connection.dialect.insert_returning:
+            # RETURNING の並びは保証されないが、1文の中の自動採番は渡した順に増えていくので並べ直す
+            ids.extend(sorted(connection.execute(statement.returning(Post.id)).scalars()))
+        else:
+            ids.extend(_inserted_ids(connection, connection.execute(statement).lastrowid, batch))
+    add_posts(session, [(row["user_id"], row["created_at"]) for row in rows])
+    session.commit()
+    return PostBulkCreated(ids=ids)
+
+
+@router.post("/posts/bulk")
+async def create_posts(*, session: Annotated[AnySession, Depends(get_session)], posts: PostBulkCreate) -> PostBulkCreated:
+    if len(posts.items) > settings.bulk_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Too many items (max {settings.bulk_max_items})"
+        )
+    result = await run_in_session(session, _create_posts, posts.items, settings.bulk_batch_size)
+    await post_cache.invalidate_posts()
+    post_events.publish("bulk_create", {"ids": result.ids})
+    return result
+
+
+# ids の投稿を削除し、実際に削除した (id, user_id) を返す。投稿数を減らすのはここで返った行の分だけにする。
+# RETURNING のある DB は DELETE の結果そのもの、MySQL は行を FOR UPDATE でロックしてから削除するので、
+# 同じ投稿を同時に削除しても後のほうは 0 件になり、投稿数を二重に減らさない。
+# ORM の DELETE なので、セッションに読み込み済みの投稿も削除済みになる
+def _delete_returning_users(session: Session, ids: list[int]) -> list[tuple[int, int]]:
+    statement = delete(Post).where(Post.id.in_(ids))
+    if session.connection().dialect.delete_returning:
+        return [tuple(row) for row in session.exec(statement.returning(Post.id, Post.user_id))]
+    locked = session.exec(select(Post.id, Post.user_id).where(Post.id.in_(ids)).with_for_update()).all()
+    if locked:
+        session.exec(delete(Post).where(Post.id.in_([id for id, _ in locked])))
+    return [tuple(row) for row in locked]
+
+
+# 存在する id を batch_size 件ずつ確認して IN で削除し、1トランザクションでコミットする
+def _delete_posts(session: Session, ids: list[int], batch_size: int) -> PostBulkDeleted:
+    ids = list(dict.fromkeys(ids))
+    found = set()
+    user_ids = []
+    for start in range(0, len(ids), batch_size):
+        deleted = _delete_returning_users(session, ids[start:start + batch_size])
+        found.update(id for id, _ in deleted)
+        user_ids.extend(user_id for _, user_id in deleted)
+    remove_posts(session, user_ids)
+    session.commit()
+    return PostBulkDeleted(deleted=[id for id in ids if id in found], missing=[id for id in ids if id not in found])
+
+
+@router.post("/posts/bulk/delete")
+async def delete_posts(*, session: Annotated[AnySession, Depends(get_session)], posts: PostBulkDelete) -> PostBulkDeleted:
+    if len(posts.ids) > settings.bulk_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Too many items (max {settings.bulk_max_items})"
+        )
+    result = await run_in_session(session, _delete_posts, posts.ids, settings.bulk_batch_size)
+    await post_cache.invalidate_posts(*result.deleted)
+    post_events.publish("bulk_delete", {"ids": result.deleted})
+    return result
+
+
+# フィードの並び順とカーソル・件数の条件を statement に付ける。
+# 本文の読み込みと ETag 用の読み込みで同じ行を選ぶために共通にしている
+def _feed_statement(statement, limit: int | None, cursor: str | None):
+    statement = statement.order_by(desc(Post.created_at), desc(Post.id))
+    if limit is None and cursor is None:
+        return statement
+
+    # カーソルモード: 前ページ最後の (created_at, id) より後ろだけを limit + 1 件読む
+    if cursor:
+        created_at, id = decode_cursor(cursor, datetime, int)
+        statement = statement.where(
+            or_(Post.created_at < created_at, and_(Post.created_at == created_at, Post.id < id))
+        )
+    return statement.limit((limit or DEFAULT_PAGE_SIZE) + 1)
+
+
+def _read_posts(session: Session, limit: int | None, cursor: str | None, fieldset: FieldSet | None):
+    # 一覧は body を読まずに抜粋を返す。投稿者は selectinload で1クエリにまとめて読み込む
+    if fieldset is None:
+        options = [load_summary_only(), selectinload(Post.user)]
+    else:
+        options = _post_load_options(fieldset, selectinload)
+    posts = session.exec(_feed_statement(select(Post).options(*options), limit, cursor)).all()
+
+    paginated = limit is not None or cursor is not None
+    next_cursor = None
+    if paginated and len(posts) > (limit or DEFAULT_PAGE_SIZE):
+        posts = posts[:limit or DEFAULT_PAGE_SIZE]
+        next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
+    etag, last_modified = collection_validators(
+        [_post_version(post, fieldset) for post in posts], next_cursor is not None, limit, cursor, _fields_key(fieldset)
+    )
+
+    if fieldset is not None:
+        items = [project(post, fieldset) for post in posts]
+        return ({"items": items, "next_cursor": next_cursor} if paginated else items), etag, last_modified
+    if paginated:
+        return PostPageWithUser(items=posts, next_cursor=next_cursor), etag, last_modified
+    return [PostSummaryWithUser.model_validate(post) for post in posts], etag, last_modified
+
+
+def _validate_posts(session: Session, limit: int | None, cursor: str | None, fieldset: FieldSet | None):
+    rows = session.exec(_feed_statement(_validator_statement(fieldset), limit, cursor)).all()
+    has_more = (limit is not None or cursor is not None) and len(rows) > (limit or DEFAULT_PAGE_SIZE)
+    if has_more:
+        rows = rows[:limit or DEFAULT_PAGE_SIZE]
+    return collection_validators(rows, has_more, limit, cursor, _fields_key(fieldset))
+
+
+# ?ids= で指定された投稿を IN の1クエリで読み、投稿者は selectinload でまとめて読む。
+# 詳細と同じ本文付きの形で、指定された順に返す。見つからなかった id は missing に入れる
+def _read_posts_by_ids(session: Session, ids: list[int], fieldset: FieldSet | None):
+    options = [selectinload(Post.user)] if fieldset is None else _post_load_options(fieldset, selectinload)
+    found = {post.id: post for post in session.exec(select(Post).options(*options).where(Post.id.in_(ids)))}
+    posts = [found[id] for id in ids if id in found]
+    missing = [id for id in ids if id not in found]
+    etag, last_modified = collection_validators([_post_version(post, fieldset) for post in posts], False, "ids", _fields_key(fieldset))
+    if fieldset is not None:
+        return {"items": [project(post, fieldset) for post in posts], "missing": missing}, etag, last_modified
+    return PostBatchWithUser(items=posts, missing=missing), etag, last_modified
+
+
+def _validate_posts_by_ids(session: Session, ids: list[int], fieldset: FieldSet | None):
+    rows = {row[0]: row for row in session.exec(_validator_statement(fieldset).where(Post.id.in_(ids)))}
+    return collection_validators([rows[id] for id in ids if id in rows], False, "ids", _fields_key(fieldset))
+
+
 @router.get("/posts")
-def read_posts(*, session: Annotated[Session, Depends(get_session)]) -> list[PostPublicWithUser]:
-    posts = session.exec(select(Post).order_by(desc(Post.created_at))).all()
-    return posts
+async def read_posts(
+    *,
+    request: Request,
+    session: Annotated[AnySession, Depends(get_read_session)],
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    cursor: str | None = None,
+    ids: str | None = None,
+    fields: str | None = None,
+) -> list[PostSummaryWithUser] | PostPageWithUser | PostBatchWithUser:
+    if ids is not None:
+        id_list = parse_ids(ids, limit, cursor)
+        fieldset = parse_fields(fields, POST_FIELDS, POST_RELATIONS)
+        # どの投稿が書き換わってもフィードのバージョンが上がるので、フィードと同じ単位で無効化される
+        key = await post_cache.feed_key("ids", ",".join(map(str, id_list)), _fields_key(fieldset))
+        return await conditional_response(
+            request, key, session, _read_posts_by_ids, _validate_posts_by_ids, id_list, fieldset
+        )
 
+    fieldset = parse_fields(fields, FEED_FIELDS, POST_RELATIONS)
+    # キャッシュにはシリアライズ済みの JSON を入れ、ヒットしたら DB もシリアライズも省く
+    key = await post_cache.feed_key(limit, cursor, _fields_key(fieldset))
+    return await conditional_response(request, key, session, _read_posts, _validate_posts, limit, cursor, fieldset)
 
-@router.get("/posts/{id}")
-def read_post(*, session: Session = Depends(get_session), id: int) -> PostPublicWithUser:
-    post = session.get(Post, id)
+
+def _search_posts(session: Session, q: str, limit: int, offset: int) -> PostSearchResults:
+    statement = search_statement(session.get_bind().dialect.name, q)
+    rows = session.exec(statement.options(selectinload(Post.user)).limit(limit + 1).offset(offset)).all()
+
+    terms = query_terms(q)
+    items = [
+        PostSearchHit(
+            **PostSummary.model_validate(post).model_dump(),
+            score=score,
+            snippet=highlight(post.body, terms),
+            user=post.user,
+        )
+        for post, score in rows[:limit]
+    ]
+    return PostSearchResults(items=items, next_offset=offset + limit if len(rows) > limit else None)
+
+
+# /posts/{id} より先に登録しないと "search" が id として扱われる
+@router.get("/posts/search")
+async def search_posts(
+    *,
+    session: Annotated[AnySession, Depends(get_read_session)],
+    q: Annotated[str, Query(min_length=1, max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    offset: Annotated[int, Query(ge=0, le=MAX_SEARCH_OFFSET)] = 0,
+) -> PostSearchResults:
+    # 空白だけのクエリは検索語がないので、空の MATCH や条件なしの検索にしない
+    if not query_terms(q):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="q must contain a search term")
+    return await run_in_session(session, _search_posts, q, limit, offset)
+
+
+# 新しい投稿・更新・削除を Server-Sent Events で送る (ポーリングの代わり)。
+# 接続ごとの負担はキュー1つとコルーチン1つだけで、DB のセッションも使わない。/posts/{id} より先に登録する。
+# post_events はプロセス内でしか配信しないので、届くのは同じワーカーで処理された書き込みだけ。
+# ワーカーやコンテナを複数にする場合は、EventHub を Redis の pub/sub などで実装するまでポーリングを併用する
+@router.get("/posts/stream")
+async def stream_posts() -> StreamingResponse:
+    subscriber = post_events.subscribe()
+    return StreamingResponse(
+        post_events.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# 全件のダンプ。id 順に流すので、途中で切れたら最後に受け取った id を after_id に渡して再開できる。
+# /posts/{id} より先に登録する
+@router.get("/posts/export")
+async def export_posts(
+    *,
+    session: Annotated[AnySession, Depends(get_read_session)],
+    format: ExportFormat = "ndjson",
+    after_id: int | None = None,
+):
+    statement = select(*(getattr(Post, column) for column in EXPORT_COLUMNS)).order_by(Post.id)
+    if after_id is not None:
+        statement = statement.where(Post.id > after_id)
+    partitions = stream_partitions(session, statement, settings.export_batch_size)
+    return export_response(partitions, EXPORT_COLUMNS, format, "posts")
+
+
+def _read_post(session: Session, id: int, fieldset: FieldSet | None):
+    options = [joinedload(Post.user)] if fieldset is None else _post_load_options(fieldset, joinedload)
+    post = session.get(Post, id, options=options)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    return post
+    etag, last_modified = post_validators([_post_version(post, fieldset)], _fields_key(fieldset))
+    if fieldset is not None:
+        return project(post, fieldset), etag, last_modified
+    return PostPublicWithUser.model_validate(post), etag, last_modified
 
 
-@router.patch("/posts/{id}")
-def update_post(*, session: Session = Depends(get_session), id: int, post: PostUpdate) -> PostPublic:
-    db_post = session.get(Post, id)
+def _validate_post(session: Session, id: int, fieldset: FieldSet | None):
+    row = session.exec(_validator_statement(fieldset).where(Post.id == id)).first()
+    if not row:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    return post_validators([row], _fields_key(fieldset))
+
+
+@router.get("/posts/{id}")
+async def read_post(
+    *, request: Request, session: AnySession = Depends(get_read_session), id: int, fields: str | None = None
+) -> PostPublicWithUser:
+    fieldset = parse_fields(fields, POST_FIELDS, POST_RELATIONS)
+    key = await post_cache.post_key(id, _fields_key(fieldset))
+    return await conditional_response(request, key, session, _read_post, _validate_post, id, fieldset)
+
+
+def _update_post(session: Session, id: int, post: PostUpdate) -> PostPublic:
+    # 同時に投稿者を付け替えても投稿数が二重に動かないよう、行をロックして今の投稿者を読む
+    db_post = session.get(Post, id, with_for_update=True)
     if not db_post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    previous_user_id = db_post.user_id
     post_data = post.model_dump(exclude_unset=True)
+    if "body" in post_data:
+        post_data["excerpt"] = make_excerpt(post_data["body"])
     db_post.sqlmodel_update(post_data)
     db_post.updated_at = datetime.now()
     session.add(db_post)
+    if db_post.user_id != previous_user_id:
+        # 付け替え元の最新の投稿日時は残った投稿から求めるので、先に flush する
+        session.flush()
+        # 2人の行は id の昇順でロックする (post_stats.py の更新と同じ順)
+        if previous_user_id < db_post.user_id:
+            remove_posts(session, [previous_user_id])
+            add_posts(session, [(db_post.user_id, db_post.created_at)])
+        else:
+            add_posts(session, [(db_post.user_id, db_post.created_at)])
+            remove_posts(session, [previous_user_id])
     session.commit()
     session.refresh(db_post)
+    return PostPublic.model_validate(db_post)
+
+
+@router.patch("/posts/{id}")
+async def update_post(*, session: AnySession = Depends(get_session), id: int, post: PostUpdate) -> PostPublic:
+    db_post = await run_in_session(session, _update_post, id, post)
+    await post_cache.invalidate_posts(id)
+    post_events.publish("update", _event_summary(db_post))
     return db_post
 
 
-@router.delete("/posts/{id}")
-def delete_post(*, session: Session = Depends(get_session), id: int):
-    post = session.get(Post, id)
-    if not post:
+def _delete_post(session: Session, id: int):
+    deleted = _delete_returning_users(session, [id])
+    if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    session.delete(post)
+    remove_posts(session, [user_id for _, user_id in deleted])
     session.commit()
+
+
+@router.delete("/posts/{id}")
+async def delete_post(*, session: AnySession = Depends(get_session), id: int) -> dict[str, bool]:
+    await run_in_session(session, _delete_post, id)
+    await post_cache.invalidate_posts(id)
+    post_events.publish("delete", {"id": id})
     return {"ok": True}
@@ -1,46 +1,248 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from passlib.context import CryptContext
-from sqlmodel import select, Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import desc, func, select, Session
 
-from ..database import get_session
-from ..models.user_model import User, UserCreate, UserPublic
-from ..models.responses import UserPublicWithPosts
+from .. import config
+from ..conditional import is_not_modified, make_etag, not_modified_response, validator_headers
+from ..database import AnySession, get_read_session, get_session, run_in_session, stream_partitions
+from ..exports import ExportFormat, export_response
+from ..fieldsets import FieldSet, load_columns, parse_fields, project
+from ..passwords import get_password_hash_async
+from ..models.post_model import Post, PostPublic, PostSummary
+from ..models.user_model import User, UserCreate, UserPublic, UserPublicWithStats
+from ..models.responses import UserBatchWithPosts, UserPageWithPosts, UserPageWithStats, UserPublicWithPostSummaries, UserPublicWithPosts
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor, parse_ids
+from ..serialization import PydanticJSONResponse
+
+settings = config.get_settings()
 
 router = APIRouter(
     prefix="/v1",
     tags=["users"],
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# ?fields= で指定できる列。投稿は posts.title のように指定する (要約の excerpt も選べる)
+USER_FIELDS = list(UserPublic.model_fields)
+USER_RELATIONS = {"posts": list(dict.fromkeys([*PostPublic.model_fields, *PostSummary.model_fields]))}
 
+# password_digest は出さない
+EXPORT_COLUMNS = ["id", "name", "email", "image", "provider", "created_at", "updated_at"]
 
-# ユーザーが入力したパスワードをハッシュ化したバスワードにする
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
+# ユーザー登録とログイン (sessions) で共有する
+def find_user(session: Session, email: str, provider: str) -> User | None:
+    return session.exec(select(User).where(User.email == email, User.provider == provider)).first()
 
-@router.post("/users")
-def create_user(*, session: Annotated[Session, Depends(get_session)], user: UserCreate) -> UserPublic:
-    is_existing_user = session.exec(select(User).where(User.email == user.email, User.provider == user.provider)).first()
-    if is_existing_user:
-        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="ユーザーは既に存在します")
-    
-    password_digest = get_password_hash(user.password)
+
+# 同じユーザーの登録が同時に来ると、後のほうは事前のチェックを通っても一意制約に当たるので 409 にする
+def _create_user(session: Session, user: UserCreate, password_digest: str) -> UserPublic:
     extra_data = {"password_digest": password_digest}
     db_user = User.model_validate(user, update=extra_data)
     session.add(db_user)
-    session.commit()
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="ユーザーは既に存在します")
     session.refresh(db_user)
-    return db_user
-    
+    return UserPublic.model_validate(db_user)
 
-@router.get("/users")
-def read_users(*, email: str | None = None, provider: str | None = None, session: Annotated[Session, Depends(get_session)]) -> list[UserPublicWithPosts] | UserPublic:
+
+@router.post("/users")
+async def create_user(*, session: Annotated[AnySession, Depends(get_session)], user: UserCreate) -> UserPublic:
+    is_existing_user = await run_in_session(session, find_user, user.email, user.provider)
+    if is_existing_user:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="ユーザーは既に存在します")
+
+    # bcrypt は DB のセッションの外 (専用スレッド) で待つ
+    password_digest = await get_password_hash_async(user.password)
+    return await run_in_session(session, _create_user, user, password_digest)
+
+
+# ページ内のユーザーの投稿を1クエリでまとめて読み込む。posts_limit があればユーザーごとに新しい順で件数を絞る。
+# columns を渡すとその列 (とまとめるのに使う user_id、ETag 用の updated_at) だけを SELECT する
+def _read_posts_by_user(session: Session, user_ids: list[int], posts_limit: int | None, columns: list[str] | None) -> dict[int, list[Post]]:
+    posts_by_user: dict[int, list[Post]] = {id: [] for id in user_ids}
+    if not user_ids:
+        return posts_by_user
+
+    statement = select(Post).where(Post.user_id.in_(user_ids))
+    if posts_limit is not None:
+        ranked = (
+            select(
+                Post.id,
+                func.row_number().over(partition_by=Post.user_id, order_by=(desc(Post.created_at), desc(Post.id))).label("rank"),
+            )
+            .where(Post.user_id.in_(user_ids))
+            .subquery()
+        )
+        statement = select(Post).join(ranked, Post.id == ranked.c.id).where(ranked.c.rank <= posts_limit)
+    if columns is not None:
+        statement = statement.options(load_columns(Post, columns, "user_id", "updated_at"))
+
+    for post in session.exec(statement.order_by(desc(Post.created_at), desc(Post.id))):
+        posts_by_user[post.user_id].append(post)
+    return posts_by_user
+
+
+def _read_users(
+    session: Session,
+    email: str | None,
+    provider: str | None,
+    limit: int | None,
+    cursor: str | None,
+    posts_limit: int | None,
+    summary: bool,
+    fieldset: FieldSet | None,
+    ids: list[int] | None = None,
+):
+    fields_key = fieldset.key() if fieldset else ""
+    user_options = [] if fieldset is None else [load_columns(User, fieldset.columns, "updated_at")]
     if email and provider:
-        user = session.exec(select(User).where(User.email == email, User.provider == provider)).one()
-        return user
-    users = session.exec(select(User)).all()
-    return users
-    
\ No newline at end of file
+        statement = select(User).options(*user_options).where(User.email == email, User.provider == provider)
+        user = session.exec(statement).one()
+        result = UserPublic.model_validate(user) if fieldset is None else project(user, fieldset)
+        return result, make_etag(user.id, user.updated_at, fields_key), user.updated_at
+
+    statement = select(User).options(*user_options).order_by(User.id)
+    if ids is not None:
+        # 指定された id だけを IN の1クエリで読み、指定された順に並べ直す
+        statement = statement.where(User.id.in_(ids))
+    # ネストした投稿には、ページングしない場合も含めて常に上限をかける
+    if posts_limit is None:
+        posts_limit = DEFAULT_PAGE_SIZE
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        if cursor:
+            (id,) = decode_cursor(cursor, int)
+            statement = statement.where(User.id > id)
+        limit = limit or DEFAULT_PAGE_SIZE
+        statement = statement.limit(limit + 1)
+    users = session.exec(statement).all()
+    missing = []
+    if ids is not None:
+        found = {user.id: user for user in users}
+        users = [found[id] for id in ids if id in found]
+        missing = [id for id in ids if id not in found]
+
+    next_cursor = None
+    if paginated and len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].id)
+    # ETag は返す行だけから作る (次ページの確認用に読んだ1行の変更では変わらない)
+    user_versions = [part for user in users for part in (user.id, user.updated_at)]
+
+    user_ids = [user.id for user in users]
+    if fieldset is None:
+        # 一覧用の要約では TEXT の body を SELECT しない
+        posts_by_user = _read_posts_by_user(session, user_ids, posts_limit, list(PostSummary.model_fields) if summary else None)
+    elif "posts" in fieldset.relations:
+        posts_by_user = _read_posts_by_user(session, user_ids, posts_limit, fieldset.relations["posts"])
+    else:
+        # 投稿を返さないなら投稿のクエリ自体を省く
+        posts_by_user = {id: [] for id in user_ids}
+    posts = [post for user_posts in posts_by_user.values() for post in user_posts]
+    etag = make_etag(
+        limit, cursor, posts_limit, summary, fields_key, ids, next_cursor is not None,
+        *user_versions, *(part for post in posts for part in (post.id, post.updated_at))
+    )
+    # 投稿の削除では最新の updated_at が進まないので、一覧には Last-Modified を付けずに ETag だけで判定する
+    last_modified = None
+
+    if fieldset is not None:
+        items = [project(user, fieldset, posts=posts_by_user[user.id]) for user in users]
+        if ids is not None:
+            return {"items": items, "missing": missing}, etag, last_modified
+        return ({"items": items, "next_cursor": next_cursor} if paginated else items), etag, last_modified
+
+    response_model, post_model = (UserPublicWithPostSummaries, PostSummary) if summary else (UserPublicWithPosts, PostPublic)
+    items = [
+        response_model(
+            **UserPublic.model_validate(user).model_dump(),
+            posts=[post_model.model_validate(post) for post in posts_by_user[user.id]],
+        )
+        for user in users
+    ]
+    if ids is not None:
+        return UserBatchWithPosts(items=items, missing=missing), etag, last_modified
+    if paginated:
+        return UserPageWithPosts(items=items, next_cursor=next_cursor), etag, last_modified
+    return items, etag, last_modified
+
+
+@router.get("/users")
+async def read_users(
+    *,
+    email: str | None = None,
+    provider: str | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    cursor: str | None = None,
+    posts_limit: Annotated[int | None, Query(ge=0, le=MAX_PAGE_SIZE)] = None,
+    summary: bool = False,
+    ids: str | None = None,
+    fields: str | None = None,
+    request: Request,
+    session: Annotated[AnySession, Depends(get_read_session)],
+) -> list[UserPublicWithPosts] | list[UserPublicWithPostSummaries] | UserPageWithPosts | UserBatchWithPosts | UserPublic:
+    id_list = None
+    if ids is not None:
+        id_list = parse_ids(ids, email, provider, limit, cursor)
+    # email と provider で1件引く場合は投稿を返さないので、投稿の列は指定できない
+    fieldset = parse_fields(fields, USER_FIELDS, {} if email and provider else USER_RELATIONS)
+    result, etag, last_modified = await run_in_session(
+        session, _read_users, email, provider, limit, cursor, posts_limit, summary, fieldset, id_list
+    )
+    # 変わっていなければシリアライズせずに 304 を返す
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    return PydanticJSONResponse(result, headers=validator_headers(etag, last_modified))
+
+
+# 投稿数と最新の投稿日時付きのユーザー一覧。User に持たせた集計を読むだけで post は読まない
+def _read_user_stats(session: Session, limit: int, cursor: str | None):
+    statement = select(User).order_by(User.id).limit(limit + 1)
+    if cursor:
+        (id,) = decode_cursor(cursor, int)
+        statement = statement.where(User.id > id)
+    users = session.exec(statement).all()
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].id)
+    # 投稿の削除で last_posted_at は古い日時に戻りうるので、Last-Modified は付けずに ETag だけで判定する
+    etag = make_etag(
+        limit, cursor, *(part for user in users for part in (user.id, user.updated_at, user.post_count, user.last_posted_at))
+    )
+    return UserPageWithStats(items=[UserPublicWithStats.model_validate(user) for user in users], next_cursor=next_cursor), etag
+
+
+@router.get("/users/stats")
+async def read_user_stats(
+    *,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+    request: Request,
+    session: Annotated[AnySession, Depends(get_read_session)],
+) -> UserPageWithStats:
+    result, etag = await run_in_session(session, _read_user_stats, limit, cursor)
+    if is_not_modified(request, etag, None):
+        return not_modified_response(etag, None)
+    return PydanticJSONResponse(result, headers=validator_headers(etag, None))
+
+
+# 全件のダンプ。id 順に流すので、途中で切れたら最後に受け取った id を after_id に渡して再開できる
+@router.get("/users/export")
+async def export_users(
+    *,
+    session: Annotated[AnySession, Depends(get_read_session)],
+    format: ExportFormat = "ndjson",
+    after_id: int | None = None,
+):
+    statement = select(*(getattr(User, column) for column in EXPORT_COLUMNS)).order_by(User.id)
+    if after_id is not None:
+        statement = statement.where(User.id > after_id)
+    partitions = stream_partitions(session, statement, settings.export_batch_size)
+    return export_response(partitions, EXPORT_COLUMNS, format, "users")
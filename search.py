@@ -0,0 +1,82 @@
+import html
+import re
+
+from sqlalchemy import DDL, column, event, func, literal_column, table
+from sqlalchemy.dialects import mysql
+from sqlmodel import desc, or_, select
+
+from .models.post_model import Post
+
+# SQLite (テスト・ローカル用) では FTS5 の外部コンテンツテーブルを post に付け、トリガーで同期する。
+# trigram トークナイザーなので空白で区切らない日本語も部分一致で引ける (MySQL 側は ngram パーサー)
+SQLITE_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, body, content='post', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+        INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+for ddl in SQLITE_FTS_DDL:
+    event.listen(Post.__table__, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+event.listen(Post.__table__, "before_drop", DDL("DROP TABLE IF EXISTS post_fts").execute_if(dialect="sqlite"))
+
+post_fts = table("post_fts", column("rowid"))
+
+MAX_QUERY_TERMS = 10
+# 全文検索インデックスで引ける最短の語の長さ。SQLite の trigram は3文字、MySQL の ngram は ngram_token_size (既定 2)
+MIN_INDEXED_TERM_LENGTH = {"sqlite": 3, "mysql": 2}
+
+
+def query_terms(q: str) -> list[str]:
+    return q.split()[:MAX_QUERY_TERMS]
+
+
+# (Post, score) を関連度の高い順に返す SELECT を DB の方言ごとに組み立てる。
+# インデックスで引けない短い語 (「日記」など) を含む場合は部分一致に切り替える。terms が空でないことは呼び出し側で確かめる
+def search_statement(dialect_name: str, q: str):
+    terms = query_terms(q)
+    if any(len(term) < MIN_INDEXED_TERM_LENGTH.get(dialect_name, 0) for term in terms):
+        dialect_name = ""
+    if dialect_name == "mysql":
+        score = mysql.match(Post.title, Post.body, against=" ".join(terms)).in_natural_language_mode()
+        return select(Post, score.label("score")).where(score > 0).order_by(desc("score"), desc(Post.id))
+    if dialect_name == "sqlite":
+        # 各語をフレーズとしてクォートし、FTS5 の演算子として解釈されないようにする
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        score = (-func.bm25(literal_column("post_fts"))).label("score")
+        return (
+            select(Post, score)
+            .join(post_fts, post_fts.c.rowid == Post.id)
+            .where(literal_column("post_fts").op("MATCH")(match))
+            .order_by(desc("score"), desc(Post.id))
+        )
+    # 全文検索インデックスがない DB では部分一致で探し、新しい順に並べる。% と _ は文字そのものとして探す
+    conditions = [or_(Post.title.contains(term, autoescape=True), Post.body.contains(term, autoescape=True)) for term in terms]
+    return select(Post, literal_column("0.0").label("score")).where(or_(*conditions)).order_by(desc(Post.created_at), desc(Post.id))
+
+
+# 本文のうち最初に検索語が出てくるあたりを切り出し、HTML エスケープしてから検索語を <mark> で囲む
+def highlight(text: str, terms: list[str], width: int = 120) -> str:
+    if not terms:
+        return html.escape(text[:width])
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 4) if first else 0
+    end = min(len(text), start + width)
+    window = text[start:end]
+
+    parts = []
+    last = 0
+    for match in pattern.finditer(window):
+        parts.append(html.escape(window[last:match.start()]))
+        parts.append("<mark>" + html.escape(match.group()) + "</mark>")
+        last = match.end()
+    parts.append(html.escape(window[last:]))
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(text) else "")
@@ -0,0 +1,12 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+# pydantic のモデル (とその list / dict) を pydantic-core で直接 JSON のバイト列にする。
+# jsonable_encoder で dict に変換してから json.dumps する JSONResponse と同じ出力になる
+# (datetime は ISO 8601、EmailStr は文字列、非 ASCII はそのまま UTF-8)
+class PydanticJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
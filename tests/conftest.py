@@ -0,0 +1,35 @@
+import asyncio
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session
+
+from ..cache import post_cache
+
+
+# テストごとに DB を作り直すので、プロセス内のレスポンスキャッシュも空にする
+@pytest.fixture(autouse=True)
+def clear_post_cache():
+    asyncio.run(post_cache.clear())
+    yield
+
+
+# with count_statements() as statements: の中で session の DB に発行された SQL を statements に記録する。
+# session はテストファイルごとの fixture を使う
+@pytest.fixture
+def count_statements(session: Session):
+    @contextmanager
+    def count():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(session.get_bind(), "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(session.get_bind(), "before_cursor_execute", record)
+
+    return count
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlmodel.pool import StaticPool
+
+from ..main import app
+from ..database import async_database_url, get_read_session, get_session
+
+
+# DB_ASYNC=true のときと同じく、ルーターに AsyncSession (aiosqlite) を渡して動かす
+@pytest.fixture(name="client")
+def client_fixture():
+    engine = create_async_engine(
+        async_database_url("sqlite://"), connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(create_all())
+
+    async def get_session_override():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    client = TestClient(app)
+    yield client
+    app.dependency_overrides.clear()
+
+
+def test_async_database_url():
+    assert async_database_url("mysql://kensuke:secret@db:3306/blog") == "mysql+aiomysql://kensuke:secret@db:3306/blog"
+    assert async_database_url("sqlite://") == "sqlite+aiosqlite://"
+
+
+def test_users_and_posts_with_async_session(client: TestClient):
+    response = client.post(
+        "/v1/users",
+        json={"name": "hoge", "email": "hoge@example.com", "image": "hoge.png", "provider": "credentials", "password": "hogehoge", "password_confirmation": "hogehoge"}
+    )
+    assert response.status_code == 200
+    user_id = response.json()["id"]
+
+    response = client.post(
+        "/v1/sessions",
+        json={"email": "hoge@example.com", "password": "hogehoge", "provider": "credentials"}
+    )
+    assert response.status_code == 200
+
+    response = client.post("/v1/posts", json={"title": "Hello", "body": "Hello World", "user_id": user_id})
+    assert response.status_code == 200
+    post_id = response.json()["id"]
+
+    response = client.patch(f"/v1/posts/{post_id}", json={"title": "Hello Update"})
+    assert response.status_code == 200
+
+    response = client.get("/v1/posts")
+    data = response.json()
+    assert response.status_code == 200
+    assert data[0]["title"] == "Hello Update"
+    assert data[0]["user"]["name"] == "hoge"
+
+    response = client.get(f"/v1/posts/{post_id}")
+    assert response.json()["user"]["name"] == "hoge"
+
+    response = client.get("/v1/users?limit=10")
+    assert response.json()["items"][0]["posts"][0]["title"] == "Hello Update"
+
+    response = client.post("/v1/oauth", json={"name": "fuga", "email": "fuga@example.com", "provider": "google"})
+    assert response.status_code == 200
+
+    response = client.get("/v1/posts/export?format=csv")
+    assert response.text.splitlines()[1].startswith(f"{post_id},{user_id},Hello Update,")
+
+    response = client.delete(f"/v1/posts/{post_id}")
+    assert response.status_code == 200
+    assert client.get(f"/v1/posts/{post_id}").status_code == 404
@@ -0,0 +1,17 @@
+import json
+
+from ..benchmarks.load_test import SCENARIOS, main
+
+
+# 負荷テストが壊れていないことを小さいデータで確かめる
+def test_load_test_reports_every_route(tmp_path):
+    output = tmp_path / "result.json"
+
+    main(["--users", "5", "--posts", "50", "--requests", "200", "--concurrency", "4", "--output", str(output)])
+    report = json.loads(output.read_text())
+
+    assert report["total"]["requests"] == 200
+    assert report["total"]["errors"] == 0
+    assert set(report["routes"]) == set(SCENARIOS)
+    assert {"p50", "p95", "p99"} <= set(report["total"]["latency_ms"])
+    assert report["routes"]["GET /v1/posts/{id}"]["queries"]["max"] <= 1
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from ..cache import MemoryCache, PostCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2)
+
+    async def scenario():
+        await cache.set("a", b"1", ttl=60)
+        await cache.set("b", b"2", ttl=60)
+        assert await cache.get("a") == b"1"
+        await cache.set("c", b"3", ttl=60)
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    assert asyncio.run(scenario()) == (b"1", None, b"3")
+    assert len(cache) == 2
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(max_entries=2)
+
+    async def scenario():
+        await cache.set("a", b"1", ttl=0.01)
+        time.sleep(0.02)
+        return await cache.get("a")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_post_cache_invalidation_changes_keys():
+    cache = PostCache(MemoryCache(max_entries=10), ttl=60)
+
+    async def scenario():
+        feed_key, post_key, other_key = await cache.feed_key(20, None), await cache.post_key(1), await cache.post_key(2)
+        await cache.invalidate_posts(1)
+        return (
+            feed_key != await cache.feed_key(20, None),
+            post_key != await cache.post_key(1),
+            other_key == await cache.post_key(2),
+        )
+
+    assert asyncio.run(scenario()) == (True, True, True)
+
+
+def test_post_cache_remembers_recent_writes():
+    cache = PostCache(MemoryCache(max_entries=10), ttl=60, recent_write_seconds=0.05)
+
+    async def scenario():
+        before = await cache.recently_written()
+        await cache.invalidate_posts(1)
+        during = await cache.recently_written()
+        await asyncio.sleep(0.06)
+        return before, during, await cache.recently_written()
+
+    assert asyncio.run(scenario()) == (False, True, False)
+
+
+def test_memory_cache_bounds_versions_without_going_back():
+    cache = MemoryCache(max_entries=2)
+
+    async def scenario():
+        for _ in range(3):
+            await cache.bump("a")
+        await cache.bump("b")
+        await cache.bump("c")
+        # 最後に上げた順に2件だけ残し、追い出した "a" は以前の番号より前に戻らない
+        return len(cache._versions), await cache.version("a"), await cache.bump("a")
+
+    assert asyncio.run(scenario()) == (2, 3, 4)
@@ -0,0 +1,118 @@
+import asyncio
+
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from ..compression import CompressionMiddleware, choose_encoding
+
+BODY = '{"title": "' + "日本語の本文" * 200 + '"}'
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=1024, encodings=["br", "zstd", "gzip"], levels={"gzip": 6, "br": 5, "zstd": 3})
+
+
+@app.get("/large")
+def large():
+    return Response(BODY, media_type="application/json", headers={"ETag": '"abc"'})
+
+
+@app.get("/small")
+def small():
+    return Response('{"ok": true}', media_type="application/json")
+
+
+@app.get("/not-modified")
+def not_modified():
+    return Response(status_code=304, headers={"ETag": '"abc"'})
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(iter([BODY.encode(), BODY.encode()]), media_type="application/x-ndjson")
+
+
+@app.get("/events")
+def events():
+    async def forever():
+        await asyncio.Event().wait()
+        yield b""
+
+    return StreamingResponse(forever(), media_type="text/event-stream")
+
+
+client = TestClient(app)
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, br", ["br", "gzip"]) == "br"
+    assert choose_encoding("gzip;q=1.0, br;q=0.5", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("br;q=0, *", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("identity", ["br", "gzip"]) is None
+    assert choose_encoding("", ["gzip"]) is None
+
+
+def test_compresses_large_responses():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < len(BODY.encode())
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"abc"'
+    assert response.text == BODY
+
+
+def test_compresses_very_large_responses_off_the_event_loop():
+    body = '{"title": "' + "日本語の本文" * 10000 + '"}'
+    large_app = FastAPI()
+    large_app.add_middleware(CompressionMiddleware, minimum_size=1024, encodings=["gzip"], levels={"gzip": 6})
+    large_app.get("/")(lambda: Response(body, media_type="application/json"))
+
+    response = TestClient(large_app).get("/", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == body
+
+
+def test_not_modified_uses_the_same_weak_etag():
+    response = client.get("/not-modified", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == 'W/"abc"'
+    assert client.get("/not-modified", headers={"Accept-Encoding": "identity"}).headers["etag"] == '"abc"'
+
+
+def test_sends_headers_of_uncompressed_streams_immediately():
+    messages = []
+
+    async def run():
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http", "method": "GET", "path": "/events", "raw_path": b"/events", "query_string": b"",
+            "headers": [(b"accept-encoding", b"gzip")], "http_version": "1.1", "scheme": "http",
+            "server": ("test", 80), "client": ("test", 1234), "root_path": "",
+        }
+        task = asyncio.create_task(app(scope, receive, send))
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(run())
+
+    # 本文が来なくてもステータスとヘッダーは送られている
+    assert messages[0]["type"] == "http.response.start"
+    assert messages[0]["status"] == 200
+
+
+def test_skips_small_not_modified_and_streaming_responses():
+    for path in ["/small", "/not-modified", "/stream"]:
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
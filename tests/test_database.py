@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+
+from ..main import app
+from ..cache import post_cache
+from ..database import PRIMARY_STICKY_COOKIE, get_read_session, get_session, make_session_dependencies
+from ..models.post_model import Post
+
+
+# プライマリとレプリカを別々の SQLite ファイルで代用する (レプリケーションはしない)
+@pytest.fixture(name="engines")
+def engines_fixture(tmp_path):
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}", connect_args={"check_same_thread": False})
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}", connect_args={"check_same_thread": False})
+    for engine, title in [(primary, "From Primary"), (replica, "From Replica")]:
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add(Post(title=title, body="Body", user_id=1))
+            session.commit()
+    yield primary, replica
+    primary.dispose()
+    replica.dispose()
+
+
+@pytest.fixture(name="client")
+def client_fixture(engines):
+    primary, replica = engines
+    get_session_override, get_read_session_override = make_session_dependencies(primary, [replica], 5)
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_read_session_override
+    client = TestClient(app)
+    yield client
+    app.dependency_overrides.clear()
+
+
+def test_reads_go_to_replica(client: TestClient):
+    response = client.get("/v1/posts")
+
+    assert response.status_code == 200
+    assert [post["title"] for post in response.json()] == ["From Replica"]
+
+
+def test_read_your_writes_after_commit(client: TestClient):
+    response = client.post("/v1/posts", json={"title": "New Post", "body": "Body", "user_id": 1})
+
+    assert response.status_code == 200
+    assert PRIMARY_STICKY_COOKIE in response.cookies
+
+    # 書き込んだ直後はプライマリから読むので自分の投稿が見える
+    response = client.get("/v1/posts")
+    assert [post["title"] for post in response.json()] == ["New Post", "From Primary"]
+
+    client.cookies.clear()
+    response = client.get("/v1/posts")
+    assert [post["title"] for post in response.json()] == ["From Replica"]
+    # 書き込み直後にレプリカから読んだ (古いかもしれない) 一覧はキャッシュに入れない
+    assert asyncio.run(post_cache.backend.get(asyncio.run(post_cache.feed_key(None, None, "")))) is None
+
+
+def test_replica_reads_are_cached_without_recent_writes(client: TestClient):
+    client.get("/v1/posts")
+
+    assert asyncio.run(post_cache.backend.get(asyncio.run(post_cache.feed_key(None, None, "")))) is not None
+
+
+def test_without_replicas_reads_go_to_primary(engines):
+    primary, _ = engines
+    _, get_read_session_override = make_session_dependencies(primary, [], 5)
+
+    app.dependency_overrides[get_read_session] = get_read_session_override
+    try:
+        response = TestClient(app).get("/v1/posts")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert [post["title"] for post in response.json()] == ["From Primary"]
@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from ..main import app
+from ..database import get_read_session, get_session
+from ..events import EventHub, post_events
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    def get_session_override():
+        return session
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    client = TestClient(app)
+    yield client
+    app.dependency_overrides.clear()
+
+
+def test_stream_sends_events_and_keepalives():
+    hub = EventHub(queue_size=10, keepalive_seconds=0.01)
+
+    async def read():
+        subscriber = hub.subscribe()
+        stream = hub.stream(subscriber)
+        hub.publish("create", {"id": 1, "title": "ほげ"})
+        chunks = [await anext(stream), await anext(stream), await anext(stream)]
+        await stream.aclose()
+        return chunks
+
+    chunks = asyncio.run(read())
+
+    assert chunks == [b"retry: 3000\n\n", 'id: 1\nevent: create\ndata: {"id":1,"title":"ほげ"}\n\n'.encode(), b": keepalive\n\n"]
+    assert len(hub) == 0
+
+
+def test_slow_subscribers_are_dropped():
+    hub = EventHub(queue_size=2, keepalive_seconds=1)
+
+    async def read():
+        slow = hub.subscribe()
+        for id in range(3):
+            hub.publish("delete", {"id": id})
+        return [chunk async for chunk in hub.stream(slow)]
+
+    chunks = asyncio.run(read())
+
+    # あふれる前の2件を送ってから dropped を送って終わる
+    assert chunks[0].startswith(b"retry:")
+    chunks = chunks[1:]
+    assert [chunk.split(b"\n")[1] for chunk in chunks] == [b"event: delete", b"event: delete", b"data: {}"]
+    assert chunks[-1].startswith(b"event: dropped")
+    assert len(hub) == 0
+
+
+def test_post_changes_are_published(client: TestClient):
+    subscriber = post_events.subscribe()
+    try:
+        id = client.post("/v1/posts", json={"title": "Hoge", "body": "HogeHoge", "user_id": 1}).json()["id"]
+        client.patch(f"/v1/posts/{id}", json={"title": "Fuga"})
+        client.delete(f"/v1/posts/{id}")
+        events = [subscriber.queue.get_nowait() for _ in range(3)]
+    finally:
+        post_events.unsubscribe(subscriber)
+
+    assert [event.type for event in events] == ["create", "update", "delete"]
+    assert json.loads(events[0].data) | {"created_at": None, "updated_at": None} == {
+        "id": id, "title": "Hoge", "excerpt": "HogeHoge", "user_id": 1, "created_at": None, "updated_at": None
+    }
+    assert json.loads(events[1].data)["title"] == "Fuga"
+    assert json.loads(events[2].data) == {"id": id}
+
+
+def test_stream_sends_headers_immediately():
+    messages = []
+
+    async def run():
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http", "method": "GET", "path": "/v1/posts/stream", "raw_path": b"/v1/posts/stream", "query_string": b"",
+            "headers": [(b"accept-encoding", b"gzip, br")], "http_version": "1.1", "scheme": "http",
+            "server": ("test", 80), "client": ("test", 1234), "root_path": "",
+        }
+        # ミドルウェアを含むアプリ全体を通して、イベントが来る前にヘッダーと最初のチャンクが届くことを確かめる
+        task = asyncio.create_task(app(scope, receive, send))
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(run())
+
+    assert messages[0]["type"] == "http.response.start"
+    assert messages[0]["status"] == 200
+    assert dict(messages[0]["headers"])[b"content-type"].startswith(b"text/event-stream")
+    assert messages[1]["body"] == b"retry: 3000\n\n"
@@ -0,0 +1,37 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import exc, text
+from sqlmodel import create_engine
+
+from ..main import app
+from ..config import get_settings
+from ..database import TimedQueuePool, engine_options, pool_wait
+
+
+def test_read_pool_stats():
+    client = TestClient(app)
+
+    response = client.get("/health/pool")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert set(data["database"]) == {"size", "checked_in", "checked_out", "overflow", "max_overflow", "wait", "replicas"}
+    assert "pending" in data["password_hasher"]
+
+
+def test_engine_options_and_pool_wait(tmp_path):
+    settings = get_settings().model_copy(update={"db_pool_size": 1, "db_max_overflow": 0, "db_pool_timeout": 0.1, "db_echo": False})
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", **engine_options(settings, TimedQueuePool))
+    before = pool_wait.snapshot()
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        assert engine.pool.checkedout() == 1
+        # プールが1本だけなので2本目は pool_timeout で諦める
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    after = pool_wait.snapshot()
+    assert engine.pool.size() == 1
+    assert after["count"] == before["count"] + 2
+    assert after["timeouts"] == before["timeouts"] + 1
@@ -0,0 +1,56 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from ..main import app
+from ..database import get_read_session, get_session
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    def get_session_override():
+        return session
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    client = TestClient(app)
+    yield client
+    app.dependency_overrides.clear()
+
+
+def test_metrics(client: TestClient):
+    client.post(
+        "/v1/users",
+        json={"name": "hoge", "email": "hoge@example.com", "image": "hoge.png", "provider": "credentials", "password": "hogehoge", "password_confirmation": "hogehoge"}
+    )
+    client.get("/v1/posts")
+    client.get("/v1/posts")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/v1/posts",status="200"}' in response.text
+    assert 'http_requests_in_progress{method="GET"}' in response.text
+    assert 'password_hash_duration_seconds_count{operation="hash"}' in response.text
+    assert 'post_cache_requests_total{result="hit"}' in response.text
+    assert 'db_pool_capacity_connections{engine="primary"} 15.0' in response.text
+
+
+def test_metrics_skip_streaming_routes(client: TestClient):
+    assert client.get("/v1/posts/export").status_code == 200
+
+    response = client.get("/metrics")
+
+    assert 'route="/v1/posts/export"' not in response.text
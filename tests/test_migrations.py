@@ -0,0 +1,77 @@
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def alembic_config(url: str) -> Config:
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("sqlalchemy.url", url)
+    return config
+
+
+def test_migrations_upgrade_baseline_data_to_models(tmp_path):
+    url = f"sqlite:///{tmp_path / 'blog.db'}"
+    config = alembic_config(url)
+    engine = create_engine(url)
+
+    # create_all で作られていた既存の DB にあたる状態から head まで上げる
+    command.upgrade(config, "0001")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO user (id, name, email, provider, created_at, updated_at, password_digest) "
+            "VALUES (1, 'hoge', 'hoge@example.com', 'credentials', '2024-01-01', '2024-01-01', 'digest')"
+        ))
+        connection.execute(text(
+            "INSERT INTO post (id, title, body, user_id, created_at, updated_at) "
+            "VALUES (1, 'Hoge', 'Hello\n\nWorld', 1, '2024-01-01', '2024-01-01')"
+        ))
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT excerpt FROM post")).scalar() == "Hello World"
+        assert connection.execute(text("SELECT rowid FROM post_fts WHERE post_fts MATCH 'World'")).scalar() == 1
+        assert connection.execute(text("SELECT post_count, last_posted_at FROM user")).one() == (1, "2024-01-01")
+    # モデルとの差分があれば例外になる
+    command.check(config)
+    assert {index["name"] for index in inspect(engine).get_indexes("post")} == {"ix_post_created_at_id", "ix_post_user_id_created_at"}
+
+    command.downgrade(config, "base")
+    assert inspect(engine).get_table_names() == ["alembic_version"]
+
+
+def test_migrations_stamp_schema_created_by_create_all(tmp_path):
+    url = f"sqlite:///{tmp_path / 'blog.db'}"
+    config = alembic_config(url)
+    engine = create_engine(url)
+
+    # alembic_version のない、create_all で作られた DB
+    command.upgrade(config, "0001")
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+
+    command.upgrade(config, "head")
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT version_num FROM alembic_version")).scalar() == "0003"
+
+
+def test_migrations_refuse_duplicate_users(tmp_path):
+    url = f"sqlite:///{tmp_path / 'blog.db'}"
+    config = alembic_config(url)
+    engine = create_engine(url)
+
+    command.upgrade(config, "0001")
+    with engine.begin() as connection:
+        for id in [1, 2]:
+            connection.execute(text(
+                "INSERT INTO user (id, name, email, provider, created_at, updated_at, password_digest) "
+                f"VALUES ({id}, 'hoge', 'hoge@example.com', 'credentials', '2024-01-01', '2024-01-01', 'digest')"
+            ))
+
+    with pytest.raises(RuntimeError, match="hoge@example.com \\(credentials\\) x2"):
+        command.upgrade(config, "head")
@@ -1,11 +1,15 @@
+from datetime import datetime
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.dialects import mysql
 from sqlmodel import Session, SQLModel, create_engine, select
 from sqlmodel.pool import StaticPool
 
 from ..main import app
-from ..database import get_session
+from ..database import get_read_session, get_session
 from ..models.user_model import User
+from ..routers.oauth import build_oauth_user_upsert, insert_oauth_user
 
 
 @pytest.fixture(name="session")
@@ -24,12 +28,13 @@ def client_fixture(session: Session):
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
 
 
-def test_create_oauth_user(client: TestClient):
+def test_create_oauth_user(session: Session, client: TestClient):
     response = client.post(
         "/v1/oauth", 
         json={"name": "hoge", "email": "hoge@example.com", "image": "hoge.png", "provider": "credentials"}
@@ -42,6 +47,9 @@ def test_create_oauth_user(client: TestClient):
     assert data["image"] == "hoge.png"
     assert data["provider"] == "credentials"
 
+    db_user = session.exec(select(User).where(User.email == "hoge@example.com")).one()
+    assert db_user.password_digest is None
+
 
 def test_create_oauth_user_with_existing_user(session: Session, client: TestClient):
     existing_user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="asfasfsafsafsasfasfff")
@@ -59,4 +67,49 @@ def test_create_oauth_user_with_existing_user(session: Session, client: TestClie
     assert data["email"] == existing_user.email
     assert data["image"] == existing_user.image
     assert data["provider"] == existing_user.provider
-    
\ No newline at end of file
+
+
+def test_create_oauth_user_repeat_login_is_one_statement(session: Session, client: TestClient, count_statements):
+    user = {"name": "hoge", "email": "hoge@example.com", "image": "hoge.png", "provider": "google"}
+    first_response = client.post("/v1/oauth", json=user)
+
+    with count_statements() as statements:
+        response = client.post("/v1/oauth", json=user)
+
+    assert response.status_code == 200
+    assert response.json()["id"] == first_response.json()["id"]
+    assert len(statements) == 1
+    assert len(session.exec(select(User)).all()) == 1
+
+
+def test_oauth_user_upsert_does_not_duplicate(session: Session):
+    values = {"name": "hoge", "email": "hoge@example.com", "image": None, "provider": "google", "created_at": datetime.now(), "updated_at": datetime.now()}
+    statement = build_oauth_user_upsert(session.get_bind().dialect.name, values)
+
+    # 別々のリクエストが同時に SELECT をすり抜けて INSERT した場合を再現する
+    session.execute(statement)
+    session.execute(statement)
+    session.commit()
+
+    assert len(session.exec(select(User)).all()) == 1
+
+
+def test_oauth_user_upsert_mysql():
+    values = {"name": "hoge", "email": "hoge@example.com", "image": None, "provider": "google", "created_at": datetime.now(), "updated_at": datetime.now()}
+    statement = build_oauth_user_upsert("mysql", values)
+
+    sql = str(statement.compile(dialect=mysql.dialect()))
+
+    assert sql.startswith("INSERT INTO user")
+    assert "ON DUPLICATE KEY UPDATE email = VALUES(email)" in sql
+
+
+def test_oauth_user_insert_falls_back_without_upsert(session: Session):
+    values = {"name": "hoge", "email": "hoge@example.com", "image": None, "provider": "google", "created_at": datetime.now(), "updated_at": datetime.now()}
+
+    assert build_oauth_user_upsert("oracle", values) is None
+    # upsert のない DB では2回目の INSERT が一意制約に当たるが、エラーにせず既存のユーザーを残す
+    insert_oauth_user(session, "oracle", values)
+    insert_oauth_user(session, "oracle", values)
+
+    assert len(session.exec(select(User)).all()) == 1
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from ..passwords import PasswordHasher
+
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(workers=1, max_pending=2)
+
+    password_digest = hasher.hash("hogehoge")
+
+    assert hasher.verify("hogehoge", password_digest)
+    assert not hasher.verify("fugafuga", password_digest)
+    assert asyncio.run(hasher.verify_async("hogehoge", password_digest))
+
+    stats = hasher.stats()
+    assert stats["completed"] == {"hash": 1, "verify": 3}
+    assert stats["pending"] == 0
+    assert stats["rejected"] == 0
+
+
+def test_reject_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    release = threading.Event()
+    blocked = hasher._submit("hash", release.wait)
+
+    with pytest.raises(HTTPException) as excinfo:
+        hasher.hash("hogehoge")
+
+    release.set()
+    blocked.result()
+
+    assert excinfo.value.status_code == 503
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.verify("hogehoge", hasher.hash("hogehoge"))
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from ..models.post_model import Post
+from ..models.user_model import User
+from ..post_stats import reconcile_post_stats
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_reconcile_post_stats(session: Session):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest") for i in range(3)]
+    session.add_all(users)
+    session.commit()
+    session.add_all([
+        Post(title="Hoge", body="Body", user_id=users[0].id, created_at=datetime(2024, 1, 1)),
+        Post(title="Hoge", body="Body", user_id=users[0].id, created_at=datetime(2024, 2, 1)),
+        Post(title="Hoge", body="Body", user_id=users[2].id, created_at=datetime(2024, 3, 1)),
+    ])
+    # 集計を更新せずに書き込んだ状態 (user1 は集計だけが残っている)
+    session.exec(update(User).where(User.id == users[1].id).values(post_count=5, last_posted_at=datetime(2024, 4, 1)))
+    session.commit()
+
+    assert reconcile_post_stats(session, batch_size=2) == 3
+    assert [(user.post_count, user.last_posted_at) for user in users] == [
+        (2, datetime(2024, 2, 1)), (0, None), (1, datetime(2024, 3, 1))
+    ]
+    # 直ったあとはずれがない
+    assert reconcile_post_stats(session) == 0
@@ -1,11 +1,23 @@
+import asyncio
+import base64
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import update
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
 from ..main import app
-from ..database import get_session
+from ..cache import post_cache
+from ..database import get_read_session, get_session
 from ..models.post_model import Post
+from ..models.user_model import User
+from ..pagination import encode_cursor
+from ..post_stats import actual_last_posted_at, actual_post_count
 
 
 @pytest.fixture(name="session")
@@ -24,6 +36,7 @@ def client_fixture(session: Session):
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -42,6 +55,147 @@ def test_create_post(client: TestClient):
     assert data["user_id"] == 1
 
 
+def test_create_and_update_post_excerpt(client: TestClient):
+    body = "一行目\n\n" + "あ" * 200
+    response = client.post("/v1/posts", json={"title": "Hoge", "body": body, "user_id": 1})
+    id = response.json()["id"]
+
+    excerpt = client.get("/v1/posts").json()[0]["excerpt"]
+    assert excerpt.startswith("一行目 あ")
+    assert len(excerpt) == 120
+    assert excerpt.endswith("…")
+    assert client.get(f"/v1/posts/{id}").json()["body"] == body
+
+    client.patch(f"/v1/posts/{id}", json={"body": "短い本文"})
+
+    assert client.get("/v1/posts").json()[0]["excerpt"] == "短い本文"
+
+
+def test_create_posts_in_bulk(session: Session, client: TestClient, count_statements):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="digest")
+    session.add(user)
+    session.commit()
+    items = [{"title": f"Post {i}", "body": f"Body {i}", "user_id": user.id} for i in range(7)]
+
+    with count_statements() as statements:
+        response = client.post("/v1/posts/bulk", json={"items": items})
+    ids = response.json()["ids"]
+
+    assert response.status_code == 200
+    assert len(ids) == 7
+    assert [session.get(Post, id).title for id in ids] == [f"Post {i}" for i in range(7)]
+    # ユーザーの確認1回と INSERT 1回 (既定の batch_size は 500)、投稿者の投稿数の UPDATE 1回
+    assert sum(statement.startswith("INSERT") for statement in statements) == 1
+    assert len(statements) == 3
+    session.refresh(user)
+    assert user.post_count == 7
+
+
+def test_create_posts_in_bulk_reports_errors_per_item(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="digest")
+    session.add(user)
+    session.commit()
+    items = [
+        {"title": "Hoge", "body": "HogeHoge", "user_id": user.id},
+        {"title": "Hoge"},
+        {"title": "Hoge", "body": "HogeHoge", "user_id": 999},
+        "Hoge",
+    ]
+
+    response = client.post("/v1/posts/bulk", json={"items": items})
+    detail = response.json()["detail"]
+
+    assert response.status_code == 422
+    assert [error["index"] for error in detail] == [1, 2, 3]
+    assert {error["loc"][0] for error in detail[0]["errors"]} == {"body", "user_id"}
+    assert detail[1]["errors"][0]["msg"] == "User not found"
+    assert detail[2]["errors"][0]["type"] == "model_attributes_type"
+    assert client.get("/v1/posts").json() == []
+
+
+def test_post_writes_maintain_user_post_stats(session: Session, client: TestClient):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest") for i in range(2)]
+    session.add_all(users)
+    session.commit()
+    alice, bob = users
+
+    def stats(user: User):
+        session.refresh(user)
+        return user.post_count, user.last_posted_at
+
+    old = client.post("/v1/posts", json={"title": "Old", "body": "Body", "user_id": alice.id, "created_at": "2024-01-01T00:00:00"}).json()
+    new = client.post("/v1/posts", json={"title": "New", "body": "Body", "user_id": alice.id, "created_at": "2024-02-01T00:00:00"}).json()
+    assert stats(alice) == (2, datetime(2024, 2, 1))
+    assert stats(bob) == (0, None)
+
+    # 投稿者を付け替えると、付け替え元は残った投稿から最新の投稿日時を求め直す
+    client.patch(f"/v1/posts/{new['id']}", json={"user_id": bob.id})
+    assert stats(alice) == (1, datetime(2024, 1, 1))
+    assert stats(bob) == (1, datetime(2024, 2, 1))
+
+    client.delete(f"/v1/posts/{old['id']}")
+    assert stats(alice) == (0, None)
+
+    ids = client.post("/v1/posts/bulk", json={"items": [
+        {"title": "Bulk", "body": "Body", "user_id": user.id, "created_at": f"2024-03-0{i + 1}T00:00:00"} for i, user in enumerate([alice, bob, bob])
+    ]}).json()["ids"]
+    assert stats(alice) == (1, datetime(2024, 3, 1))
+    assert stats(bob) == (3, datetime(2024, 3, 3))
+
+    client.post("/v1/posts/bulk/delete", json={"ids": ids[1:]})
+    assert stats(bob) == (1, datetime(2024, 2, 1))
+
+    # 削除済みの投稿をもう一度削除しても、投稿数は DELETE で実際に消えた分しか減らない
+    assert client.post("/v1/posts/bulk/delete", json={"ids": ids}).json() == {"deleted": [ids[0]], "missing": ids[1:]}
+    assert client.delete(f"/v1/posts/{old['id']}").status_code == 404
+    assert stats(alice) == (0, None)
+    assert stats(bob) == (1, datetime(2024, 2, 1))
+
+
+def test_update_post_reassign_updates_user_post_stats(session: Session, client: TestClient):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest") for i in range(2)]
+    session.add_all(users)
+    session.commit()
+    source, target = users
+    old = Post(title="Old", body="Body", user_id=source.id, created_at=datetime(2024, 1, 1))
+    new = Post(title="New", body="Body", user_id=source.id, created_at=datetime(2024, 3, 1))
+    latest = Post(title="Latest", body="Body", user_id=target.id, created_at=datetime(2024, 2, 1))
+    session.add_all([old, new, latest])
+    session.commit()
+    session.exec(update(User).values(post_count=actual_post_count(), last_posted_at=actual_last_posted_at()))
+    session.commit()
+
+    response = client.patch(f"/v1/posts/{new.id}", json={"user_id": target.id})
+    assert response.status_code == 200
+
+    session.refresh(source)
+    session.refresh(target)
+    # 付け替え元は残った投稿から求め直し、付け替え先は新しいほうの日時になる
+    assert (source.post_count, source.last_posted_at) == (1, datetime(2024, 1, 1))
+    assert (target.post_count, target.last_posted_at) == (2, datetime(2024, 3, 1))
+
+    client.patch(f"/v1/posts/{old.id}", json={"user_id": target.id})
+    session.refresh(source)
+    session.refresh(target)
+    # 古い投稿を付け替えても付け替え先の最新の投稿日時は戻らない
+    assert (source.post_count, source.last_posted_at) == (0, None)
+    assert (target.post_count, target.last_posted_at) == (3, datetime(2024, 3, 1))
+
+
+def test_delete_posts_in_bulk(session: Session, client: TestClient):
+    posts = [Post(title=f"Post {i}", body="Body", user_id=1) for i in range(3)]
+    session.add_all(posts)
+    session.commit()
+    ids = [post.id for post in posts]
+    assert len(client.get("/v1/posts").json()) == 3
+
+    response = client.post("/v1/posts/bulk/delete", json={"ids": [ids[2], 999, ids[0]]})
+
+    assert response.status_code == 200
+    assert response.json() == {"deleted": [ids[2], ids[0]], "missing": [999]}
+    assert [post["id"] for post in client.get("/v1/posts").json()] == [ids[1]]
+
+
 def test_create_post_incomplete(client: TestClient):
     # No user_id
     response = client.post(
@@ -65,8 +219,8 @@ def test_create_post_invalid(client: TestClient):
 
 
 def test_read_posts(session: Session, client: TestClient):
-    post_1 = Post(title="Hello", body="Hello World", user_id=1)
-    post_2 = Post(title="Sample Title", body="Sample Body", user_id=2)
+    post_1 = Post(title="Hello", body="Hello World", excerpt="Hello World", user_id=1)
+    post_2 = Post(title="Sample Title", body="Sample Body", excerpt="Sample Body", user_id=2)
     session.add(post_1)
     session.add(post_2)
     session.commit()
@@ -78,12 +232,72 @@ def test_read_posts(session: Session, client: TestClient):
 
     assert len(data) == 2
     assert data[0]["title"] == post_2.title
-    assert data[0]["body"] == post_2.body
+    assert data[0]["excerpt"] == post_2.excerpt
     assert data[0]["user_id"] == post_2.user_id
     assert data[1]["title"] == post_1.title
-    assert data[1]["body"] == post_1.body
+    assert data[1]["excerpt"] == post_1.excerpt
     assert data[1]["user_id"] == post_1.user_id
-    
+    assert "body" not in data[0]
+
+
+def test_read_posts_with_cursor(session: Session, client: TestClient):
+    created_at = datetime(2024, 8, 1, 12, 0, 0)
+    for i in range(5):
+        # 同じ created_at の投稿も id でページをまたいで順序が保たれること
+        session.add(Post(title=f"Post {i}", body="Body", user_id=1, created_at=created_at if i < 3 else created_at + timedelta(minutes=i)))
+    session.commit()
+
+    response = client.get("/v1/posts?limit=2")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [post["title"] for post in data["items"]] == ["Post 4", "Post 3"]
+    assert data["next_cursor"] is not None
+
+    response = client.get(f"/v1/posts?limit=2&cursor={data['next_cursor']}")
+    data = response.json()
+
+    assert [post["title"] for post in data["items"]] == ["Post 2", "Post 1"]
+
+    response = client.get(f"/v1/posts?limit=2&cursor={data['next_cursor']}")
+    data = response.json()
+
+    assert [post["title"] for post in data["items"]] == ["Post 0"]
+    assert data["next_cursor"] is None
+
+
+def test_read_posts_with_invalid_cursor(client: TestClient):
+    response = client.get("/v1/posts?limit=2&cursor=invalid")
+
+    assert response.status_code == 400
+    # BIGINT に収まらない id も DB に渡さず 400 にする
+    for cursor in [encode_cursor(datetime(2024, 1, 1), 10**30), base64.urlsafe_b64encode(b'["2024-01-01T00:00:00",1e30]').decode()]:
+        response = client.get(f"/v1/posts?limit=2&cursor={cursor}")
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_read_posts_query_count_does_not_grow_with_posts(session: Session, client: TestClient, count_statements):
+    def query_count(number_of_users: int) -> int:
+        for i in range(number_of_users):
+            user = User(name=f"user{i}", email=f"user{number_of_users}-{i}@example.com", provider="credentials", password_digest="digest")
+            session.add(user)
+            session.commit()
+            session.add(Post(title="Title", body="Body", user_id=user.id))
+            session.commit()
+        session.expunge_all()
+        asyncio.run(post_cache.clear())
+
+        with count_statements() as statements:
+            response = client.get("/v1/posts")
+        assert response.status_code == 200
+        assert all(post["user"] is not None for post in response.json())
+        # 一覧では TEXT の body を SELECT しない
+        assert not any("post.body" in statement for statement in statements)
+        return len(statements)
+
+    assert query_count(2) == query_count(10)
+
 
 def test_read_post(session: Session, client: TestClient):
     post = Post(title="Hoge", body="HogeHoge", user_id=1)
@@ -99,6 +313,100 @@ def test_read_post(session: Session, client: TestClient):
     assert data["user_id"] == post.user_id
 
 
+def test_read_posts_with_fields(session: Session, client: TestClient, count_statements):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="digest")
+    session.add(user)
+    session.commit()
+    session.add(Post(title="Hoge", body="HogeHoge", user_id=user.id))
+    session.commit()
+    session.expunge_all()
+
+    with count_statements() as statements:
+        response = client.get("/v1/posts?fields=title,user.name&limit=10")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["items"] == [{"title": "Hoge", "user": {"name": "hoge"}}]
+    assert len(statements) == 2
+    assert "excerpt" not in statements[0]
+    assert "email" not in statements[1]
+
+
+def test_read_post_with_fields(session: Session, client: TestClient):
+    post = Post(title="Hoge", body="HogeHoge", user_id=1)
+    session.add(post)
+    session.commit()
+
+    response = client.get(f"/v1/posts/{post.id}?fields=id,body")
+
+    assert response.status_code == 200
+    assert response.json() == {"body": "HogeHoge", "id": post.id}
+    assert client.get(f"/v1/posts/{post.id}?fields=password").status_code == 400
+    assert client.get("/v1/posts?fields=body").status_code == 400
+
+
+def test_read_posts_by_ids(session: Session, client: TestClient, count_statements):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest") for i in range(2)]
+    session.add_all(users)
+    session.commit()
+    posts = [Post(title=f"Title{i}", body=f"Body{i}", user_id=users[i % 2].id) for i in range(3)]
+    session.add_all(posts)
+    session.commit()
+    ids = [post.id for post in posts]
+    session.expunge_all()
+
+    with count_statements() as statements:
+        response = client.get(f"/v1/posts?ids={ids[2]},999,{ids[0]},{ids[2]}")
+    data = response.json()
+
+    assert response.status_code == 200
+    # 指定した順に、本文と投稿者付きで返し、見つからない id は missing に入る
+    assert [post["id"] for post in data["items"]] == [ids[2], ids[0]]
+    assert [post["body"] for post in data["items"]] == ["Body2", "Body0"]
+    assert [post["user"]["name"] for post in data["items"]] == ["user0", "user0"]
+    assert data["missing"] == [999]
+    # 投稿の IN と投稿者の IN の2クエリだけ
+    assert len(statements) == 2
+
+    response = client.get(f"/v1/posts?ids={ids[1]},{ids[0]}&fields=title,user.name")
+    assert response.json() == {
+        "items": [{"title": "Title1", "user": {"name": "user1"}}, {"title": "Title0", "user": {"name": "user0"}}],
+        "missing": [],
+    }
+    etag = response.headers["etag"]
+    assert client.get(f"/v1/posts?ids={ids[1]},{ids[0]}&fields=title,user.name", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_read_posts_by_ids_invalid(client: TestClient):
+    assert client.get("/v1/posts?ids=1,a").status_code == 400
+    assert client.get("/v1/posts?ids=").status_code == 400
+    assert client.get("/v1/posts?ids=" + ",".join(str(i) for i in range(1, 102))).status_code == 400
+    assert client.get("/v1/posts?ids=1&limit=10").status_code == 400
+    assert client.get("/v1/posts?ids=99999999999999999999999").json()["detail"] == "Invalid ids"
+    assert client.get("/v1/posts?ids=0,-1").status_code == 400
+
+
+def test_export_posts(session: Session, client: TestClient):
+    posts = [Post(title=f"Post {i}", body=f"Body {i}", user_id=1) for i in range(3)]
+    session.add_all(posts)
+    session.commit()
+    ids = [post.id for post in posts]
+
+    response = client.get("/v1/posts/export")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [line["id"] for line in lines] == ids
+    assert lines[0]["body"] == "Body 0"
+
+    response = client.get(f"/v1/posts/export?format=csv&after_id={ids[0]}")
+    rows = list(csv.reader(io.StringIO(response.text)))
+
+    assert rows[0] == ["id", "user_id", "title", "body", "excerpt", "created_at", "updated_at"]
+    assert [int(row[0]) for row in rows[1:]] == ids[1:]
+
+
 def test_read_post_not_found(session: Session, client: TestClient):
     post = Post(title="Hoge", body="HogeHoge", user_id=1)
     session.add(post)
@@ -161,3 +469,148 @@ def test_delete_post_not_found(session: Session, client: TestClient):
     response = client.delete("/v1/posts/100")
 
     assert response.status_code == 404
+
+
+def test_read_posts_is_cached_until_posts_change(session: Session, client: TestClient):
+    post = Post(title="Hoge", body="HogeHoge", user_id=1)
+    session.add(post)
+    session.commit()
+
+    assert client.get("/v1/posts").json()[0]["title"] == "Hoge"
+    assert client.get(f"/v1/posts/{post.id}").json()["title"] == "Hoge"
+
+    # API を通さずに変更したものはキャッシュが返る
+    post.title = "Changed outside the API"
+    session.add(post)
+    session.commit()
+
+    assert client.get("/v1/posts").json()[0]["title"] == "Hoge"
+    assert client.get(f"/v1/posts/{post.id}").json()["title"] == "Hoge"
+
+    client.patch(f"/v1/posts/{post.id}", json={"title": "Fuga"})
+
+    assert client.get("/v1/posts").json()[0]["title"] == "Fuga"
+    assert client.get(f"/v1/posts/{post.id}").json()["title"] == "Fuga"
+
+    client.delete(f"/v1/posts/{post.id}")
+
+    assert client.get("/v1/posts").json() == []
+    assert client.get(f"/v1/posts/{post.id}").status_code == 404
+
+
+def test_read_posts_conditional_get(session: Session, client: TestClient):
+    post = Post(title="Hoge", body="HogeHoge", user_id=1)
+    session.add(post)
+    session.commit()
+
+    for url in ["/v1/posts", "/v1/posts?limit=10", f"/v1/posts/{post.id}"]:
+        response = client.get(url)
+        etag = response.headers["etag"]
+
+        assert response.status_code == 200
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+        # キャッシュがなくても (id, updated_at) だけで 304 を返せる
+        asyncio.run(post_cache.clear())
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    client.patch(f"/v1/posts/{post.id}", json={"title": "Fuga"})
+
+    response = client.get(f"/v1/posts/{post.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+    # Last-Modified は詳細にだけ付ける
+    last_modified = response.headers["last-modified"]
+    assert client.get(f"/v1/posts/{post.id}", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+
+def test_read_posts_collection_validators(session: Session, client: TestClient):
+    posts = [Post(title=f"Post {i}", body="Body", user_id=1, created_at=datetime(2024, 1, i + 1)) for i in range(3)]
+    session.add_all(posts)
+    session.commit()
+
+    # 一覧は Last-Modified を付けない (削除しても最新の updated_at は進まないため)
+    response = client.get("/v1/posts?limit=2")
+    assert "last-modified" not in response.headers
+    etag = response.headers["etag"]
+
+    # ページの外 (次ページの確認用に読む行) が変わっても ETag は変わらない
+    client.patch(f"/v1/posts/{posts[0].id}", json={"title": "Fuga"})
+    asyncio.run(post_cache.clear())
+    assert client.get("/v1/posts?limit=2", headers={"If-None-Match": etag}).status_code == 304
+
+    client.delete(f"/v1/posts/{posts[1].id}")
+    assert client.get("/v1/posts?limit=2", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_search_posts(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", provider="credentials", password_digest="digest")
+    session.add(user)
+    session.commit()
+    session.add(Post(title="SvelteKit と FastAPI", body="FastAPI でブログの API を作る。FastAPI は速い。", user_id=user.id))
+    session.add(Post(title="日記", body="今日は <b>FastAPI</b> を少し触った", user_id=user.id))
+    session.add(Post(title="料理", body="カレーを作った", user_id=user.id))
+    session.commit()
+
+    response = client.get("/v1/posts/search?q=FastAPI")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [hit["title"] for hit in data["items"]] == ["SvelteKit と FastAPI", "日記"]
+    assert data["items"][0]["user"]["name"] == "hoge"
+    assert "<mark>FastAPI</mark>" in data["items"][0]["snippet"]
+    assert "&lt;b&gt;<mark>FastAPI</mark>&lt;/b&gt;" in data["items"][1]["snippet"]
+    assert "body" not in data["items"][0]
+    assert data["next_offset"] is None
+
+    response = client.get("/v1/posts/search?q=ブログの&limit=1")
+    assert [hit["title"] for hit in response.json()["items"]] == ["SvelteKit と FastAPI"]
+
+    response = client.get("/v1/posts/search?q=FastAPI&limit=1")
+    data = response.json()
+    assert len(data["items"]) == 1
+    assert data["next_offset"] == 1
+
+    # 更新・削除もインデックスに反映される
+    client.patch(f"/v1/posts/{data['items'][0]['id']}", json={"title": "Svelte", "body": "フロントエンド"})
+    response = client.get("/v1/posts/search?q=FastAPI")
+    assert [hit["title"] for hit in response.json()["items"]] == ["日記"]
+
+
+def test_search_posts_with_short_terms(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", provider="credentials", password_digest="digest")
+    session.add(user)
+    session.commit()
+    session.add(Post(title="今日の日記", body="散歩した", user_id=user.id))
+    session.add(Post(title="料理", body="カレーを作った", user_id=user.id))
+    session.commit()
+
+    # trigram では引けない2文字の語も部分一致で見つかる
+    response = client.get("/v1/posts/search?q=日記")
+
+    assert response.status_code == 200
+    assert [hit["title"] for hit in response.json()["items"]] == ["今日の日記"]
+
+
+def test_search_posts_treats_wildcards_literally(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", provider="credentials", password_digest="digest")
+    session.add(user)
+    session.commit()
+    session.add(Post(title="割引", body="50%オフ", user_id=user.id))
+    session.add(Post(title="変数名", body="snake_case", user_id=user.id))
+    session.add(Post(title="料理", body="カレーを作った", user_id=user.id))
+    session.commit()
+
+    # 短い語は LIKE で探すが、% と _ はワイルドカードにならない
+    assert [hit["title"] for hit in client.get("/v1/posts/search?q=%25").json()["items"]] == ["割引"]
+    assert [hit["title"] for hit in client.get("/v1/posts/search?q=_").json()["items"]] == ["変数名"]
+
+
+def test_search_posts_without_query(client: TestClient):
+    response = client.get("/v1/posts/search?q=")
+
+    assert response.status_code == 422
+    assert client.get("/v1/posts/search?q=%20%20").status_code == 422
@@ -0,0 +1,107 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from ..main import app
+from ..database import get_read_session, get_session
+from ..models.post_model import Post
+from ..models.user_model import User
+from ..query_stats import QueryStats, QueryStatsMiddleware, current_stats, statement_shape
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    def get_session_override():
+        return session
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    client = TestClient(app)
+    yield client
+    app.dependency_overrides.clear()
+
+
+def test_statement_shape():
+    assert statement_shape("SELECT * FROM post\n WHERE id IN (?, ?, ?)") == "SELECT * FROM post WHERE id IN (?)"
+    assert statement_shape("SELECT * FROM post WHERE id IN (%s)") == "SELECT * FROM post WHERE id IN (?)"
+
+
+# ルートごとのクエリ数の上限。投稿やユーザーの数が増えても変わらないこと
+@pytest.mark.parametrize(
+    "path, budget",
+    [
+        ("/v1/posts", 2),
+        ("/v1/posts?limit=5", 2),
+        ("/v1/posts/{post_id}", 1),
+        ("/v1/posts/search?q=Hoge", 2),
+        ("/v1/users", 2),
+        ("/v1/users?limit=5&summary=true", 2),
+        ("/v1/users?fields=name", 1),
+    ],
+)
+def test_query_budget(session: Session, client: TestClient, path: str, budget: int):
+    for i in range(10):
+        user = User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest")
+        session.add(user)
+        session.commit()
+        session.add_all([Post(title=f"Hoge {i}-{j}", body="HogeHoge", user_id=user.id) for j in range(3)])
+        session.commit()
+    post_id = session.exec(text("SELECT max(id) FROM post")).scalar()
+    session.expunge_all()
+
+    response = client.get(path.format(post_id=post_id))
+
+    assert response.status_code == 200
+    assert int(response.headers["x-query-count"]) == budget
+    assert response.headers["server-timing"].startswith("db;dur=")
+    assert "x-query-repeated" not in response.headers
+
+
+def test_flags_repeated_statements(caplog):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    n_plus_one_app = FastAPI()
+    n_plus_one_app.add_middleware(QueryStatsMiddleware, n_plus_one_threshold=3)
+
+    @n_plus_one_app.get("/")
+    def loop() -> list[int]:
+        with engine.connect() as connection:
+            return [connection.execute(text("SELECT :id"), {"id": id}).scalar() for id in range(4)]
+
+    response = TestClient(n_plus_one_app).get("/")
+
+    assert response.headers["x-query-count"] == "4"
+    assert response.headers["x-query-repeated"] == "4"
+    assert "Possible N+1 on GET /: 4 x SELECT ?" in caplog.text
+
+
+def test_failed_statements_do_not_leave_timings_behind():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    stats = QueryStats()
+    token = current_stats.set(stats)
+    try:
+        with engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+            connection.execute(text("SELECT 1"))
+            info = dict(connection.info)
+    finally:
+        current_stats.reset(token)
+
+    # 失敗した SQL は記録されず、接続にも何も残らない
+    assert stats.count == 1
+    assert stats.slowest_statement == "SELECT 1"
+    assert "query_stats_started" not in info
@@ -0,0 +1,22 @@
+from sqlalchemy.dialects import mysql
+
+from ..search import highlight, search_statement
+
+
+def test_search_statement_mysql():
+    statement = search_statement("mysql", "FastAPI ブログ")
+
+    sql = str(statement.compile(dialect=mysql.dialect()))
+
+    assert "MATCH (post.title, post.body) AGAINST (%s IN NATURAL LANGUAGE MODE)" in sql
+    assert "ORDER BY score DESC" in sql
+
+
+def test_highlight():
+    body = "あ" * 100 + "FastAPI と fastapi <script>" + "い" * 100
+
+    snippet = highlight(body, ["FastAPI"], width=60)
+
+    assert snippet.startswith("…")
+    assert snippet.endswith("…")
+    assert "<mark>FastAPI</mark> と <mark>fastapi</mark> &lt;script&gt;" in snippet
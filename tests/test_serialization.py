@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from ..models.responses import PostSummaryWithUser
+from ..models.user_model import UserPublic
+from ..serialization import PydanticJSONResponse
+
+
+def test_pydantic_json_response_matches_default_encoding():
+    now = datetime(2024, 1, 2, 3, 4, 5, 678901)
+    user = UserPublic(id=1, name="ほげ", email="hoge@example.com", image=None, provider="credentials", created_at=now, updated_at=now)
+    posts = [PostSummaryWithUser(id=1, title="タイトル", excerpt="本文", user_id=1, created_at=now, updated_at=now, user=user)]
+
+    body = PydanticJSONResponse(posts).body
+
+    assert body == JSONResponse(jsonable_encoder(posts)).body
+    assert b'"created_at":"2024-01-02T03:04:05.678901"' in body
+    assert b'"email":"hoge@example.com"' in body
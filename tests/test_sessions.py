@@ -2,23 +2,11 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
-from passlib.context import CryptContext
 
 from ..main import app
-from ..database import get_session
+from ..database import get_read_session, get_session
 from ..models.user_model import User
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-# ユーザーが入力したパスワードをハッシュ化したバスワードにする
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
-# ユーザーが入力したパスワードとハッシュ化したパスワードが一致するか確認する
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+from ..passwords import get_password_hash
 
 
 @pytest.fixture(name="session")
@@ -37,6 +25,7 @@ def client_fixture(session: Session):
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -84,4 +73,16 @@ def test_authenticate_invalid_password(session: Session, client: TestClient):
     )
 
     assert response.status_code == 401
-    
\ No newline at end of file
+
+
+def test_authenticate_oauth_user_without_password(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="google")
+    session.add(user)
+    session.commit()
+
+    response = client.post(
+        "/v1/sessions",
+        json={"email": "hoge@example.com", "password": "hogehoge", "provider": "google"}
+    )
+
+    assert response.status_code == 401
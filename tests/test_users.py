@@ -1,11 +1,19 @@
+import base64
+import json
+from datetime import datetime
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import update
+from sqlmodel import Session, SQLModel, create_engine, select
 from sqlmodel.pool import StaticPool
 
 from ..main import app
-from ..database import get_session
+from ..database import get_read_session, get_session
+from ..models.post_model import Post
 from ..models.user_model import User
+from ..pagination import DEFAULT_PAGE_SIZE, encode_cursor
+from ..routers import users
 
 
 @pytest.fixture(name="session")
@@ -24,6 +32,7 @@ def client_fixture(session: Session):
         return session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
@@ -43,6 +52,22 @@ def test_create_user(client: TestClient):
     assert data["provider"] == "credentials"
 
 
+def test_create_user_concurrent_duplicate(session: Session, client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    session.add(User(name="hoge", email="hoge@example.com", provider="credentials", password_digest="digest"))
+    session.commit()
+    # 同時に来た登録が、どちらも既存ユーザーのチェックを通った後に INSERT する場合
+    monkeypatch.setattr(users, "find_user", lambda session, email, provider: None)
+
+    response = client.post(
+        "/v1/users",
+        json={"name": "hoge", "email": "hoge@example.com", "provider": "credentials", "password": "hogehoge", "password_confirmation": "hogehoge"}
+    )
+
+    assert response.status_code == 409
+    assert response.json() == {"detail": "ユーザーは既に存在します"}
+    assert len(session.exec(select(User)).all()) == 1
+
+
 def test_create_user_invalid(session: Session, client: TestClient):
     user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="asfasfsafsafsasfasfff")
     session.add(user)
@@ -92,3 +117,174 @@ def test_read_users_with_query_params_email_and_provider(session: Session, clien
     assert data["email"] == user.email
     assert data["image"] == user.image
     assert data["provider"] == user.provider
+
+
+def test_read_users_with_pagination(session: Session, client: TestClient):
+    for i in range(3):
+        user = User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="asfasfsafsafsasfasfff")
+        session.add(user)
+        session.commit()
+        for j in range(3):
+            session.add(Post(title=f"Post {i}-{j}", body="Body", user_id=user.id))
+        session.commit()
+
+    response = client.get("/v1/users?limit=2&posts_limit=2")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [user["name"] for user in data["items"]] == ["user0", "user1"]
+    assert [len(user["posts"]) for user in data["items"]] == [2, 2]
+    assert data["items"][0]["posts"][0]["body"] == "Body"
+    assert data["next_cursor"] is not None
+
+    response = client.get(f"/v1/users?limit=2&posts_limit=2&cursor={data['next_cursor']}")
+    data = response.json()
+
+    assert [user["name"] for user in data["items"]] == ["user2"]
+    assert data["next_cursor"] is None
+
+
+def test_read_users_with_invalid_cursor(client: TestClient):
+    for cursor in ["invalid", encode_cursor(0), encode_cursor(10**30), base64.urlsafe_b64encode(b"[1e30]").decode()]:
+        response = client.get(f"/v1/users?limit=2&cursor={cursor}")
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_read_users_limits_posts_without_pagination(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", provider="credentials", password_digest="asfasfsafsafsasfasfff")
+    session.add(user)
+    session.commit()
+    session.add_all([Post(title=f"Post {i}", body="Body", user_id=user.id) for i in range(DEFAULT_PAGE_SIZE + 1)])
+    session.commit()
+
+    # ページングしなくても、ユーザーごとの投稿は新しい順に DEFAULT_PAGE_SIZE 件まで
+    assert len(client.get("/v1/users").json()[0]["posts"]) == DEFAULT_PAGE_SIZE
+    assert len(client.get("/v1/users?posts_limit=3").json()[0]["posts"]) == 3
+
+
+def test_read_users_with_post_summaries(session: Session, client: TestClient, count_statements):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="asfasfsafsafsasfasfff")
+    session.add(user)
+    session.commit()
+    session.add(Post(title="Hello", body="Hello World", user_id=user.id))
+    session.commit()
+
+    with count_statements() as statements:
+        response = client.get("/v1/users?summary=true")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data[0]["posts"][0]["title"] == "Hello"
+    assert "body" not in data[0]["posts"][0]
+    assert len(statements) == 2
+    assert all("body" not in statement for statement in statements)
+
+
+def test_read_users_with_fields(session: Session, client: TestClient, count_statements):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="asfasfsafsafsasfasfff")
+    session.add(user)
+    session.commit()
+    session.add(Post(title="Hello", body="Hello World", user_id=user.id))
+    session.commit()
+    session.expunge_all()
+
+    with count_statements() as statements:
+        names = client.get("/v1/users?fields=name").json()
+        with_posts = client.get("/v1/users?fields=name,posts.title").json()
+
+    assert names == [{"name": "hoge"}]
+    assert with_posts == [{"name": "hoge", "posts": [{"title": "Hello"}]}]
+    # 投稿を指定しなければ投稿のクエリは発行されない
+    assert len(statements) == 3
+    assert all("email" not in statement and "body" not in statement for statement in statements)
+    assert client.get("/v1/users?fields=password_digest").status_code == 400
+
+
+def test_read_users_by_ids(session: Session, client: TestClient, count_statements):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest") for i in range(3)]
+    session.add_all(users)
+    session.commit()
+    session.add(Post(title="Hello", body="Hello World", user_id=users[2].id))
+    session.commit()
+    ids = [user.id for user in users]
+    session.expunge_all()
+
+    with count_statements() as statements:
+        response = client.get(f"/v1/users?ids={ids[2]},999,{ids[0]}&summary=true")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [user["name"] for user in data["items"]] == ["user2", "user0"]
+    assert [post["title"] for post in data["items"][0]["posts"]] == ["Hello"]
+    assert data["missing"] == [999]
+    assert len(statements) == 2
+
+    response = client.get(f"/v1/users?ids={ids[1]}&fields=name")
+    assert response.json() == {"items": [{"name": "user1"}], "missing": []}
+    assert client.get("/v1/users?ids=1,x").status_code == 400
+    assert client.get("/v1/users?ids=1&cursor=abc").json()["detail"] == "ids cannot be combined with other filters or pagination"
+    assert client.get("/v1/users?ids=99999999999999999999999").status_code == 400
+
+
+def test_read_user_stats(session: Session, client: TestClient, count_statements):
+    users = [User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest") for i in range(3)]
+    session.add_all(users)
+    session.commit()
+    client.post("/v1/posts", json={"title": "Hello", "body": "Hello World", "user_id": users[1].id, "created_at": "2024-01-01T00:00:00"})
+
+    with count_statements() as statements:
+        response = client.get("/v1/users/stats?limit=2")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [(user["name"], user["post_count"], user["last_posted_at"]) for user in data["items"]] == [
+        ("user0", 0, None), ("user1", 1, "2024-01-01T00:00:00")
+    ]
+    # 投稿は読まない
+    assert len(statements) == 1
+    assert "post" not in statements[0].replace("post_count", "").replace("last_posted_at", "")
+    assert [user["name"] for user in client.get(f"/v1/users/stats?cursor={data['next_cursor']}").json()["items"]] == ["user2"]
+
+    etag = response.headers["etag"]
+    assert client.get("/v1/users/stats?limit=2", headers={"If-None-Match": etag}).status_code == 304
+    client.post("/v1/posts", json={"title": "Hello", "body": "Hello World", "user_id": users[0].id})
+    assert client.get("/v1/users/stats?limit=2", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_read_users_conditional_get(session: Session, client: TestClient):
+    user = User(name="hoge", email="hoge@example.com", image="hoge.png", provider="credentials", password_digest="asfasfsafsafsasfasfff")
+    session.add(user)
+    session.commit()
+
+    response = client.get("/v1/users")
+    etag = response.headers["etag"]
+
+    assert client.get("/v1/users", headers={"If-None-Match": etag}).status_code == 304
+
+    session.add(Post(title="Hello", body="Hello World", user_id=user.id))
+    session.commit()
+
+    assert client.get("/v1/users", headers={"If-None-Match": etag}).status_code == 200
+    assert "last-modified" not in response.headers
+
+    session.add(User(name="fuga", email="fuga@example.com", provider="credentials", password_digest="digest"))
+    session.commit()
+    etag = client.get("/v1/users?limit=1").headers["etag"]
+    # 2人目 (次ページの確認用に読む行) を更新しても1ページ目の ETag は変わらない
+    session.exec(update(User).where(User.name == "fuga").values(updated_at=datetime(2030, 1, 1)))
+    session.commit()
+    assert client.get("/v1/users?limit=1", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_export_users(session: Session, client: TestClient):
+    for i in range(3):
+        session.add(User(name=f"user{i}", email=f"user{i}@example.com", provider="credentials", password_digest="digest"))
+    session.commit()
+
+    response = client.get("/v1/users/export?after_id=1")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert [line["name"] for line in lines] == ["user1", "user2"]
+    assert "password_digest" not in lines[0]